@@ -46,30 +46,64 @@ The variable defines one csv statement block. A csv statement block has a
 header that starts with the name of the class followed by some of its attributes.
 The lines starting with '+' represent the csv statements, in particular, csv 
 insert statements.
-There are three types of csv statements:
+There are four types of csv statements:
     - '+' insert
     - '-' delete
     - '~' update
+    - '*' upsert, an update if the keys match a row, otherwise an insert
 
 Lines starting with '#', with the first column empty and empty lines are ignored.
+The field \\N is a NULL value (None), the text \\N is escaped as '\\N.
 
 Copyright (c) 2008. All rights reserved.
 """
 
 import csv
+import os
 import re
 
-from datetime  import date
-from itertools import count
-from operator  import attrgetter, and_, eq
-from types     import MethodType
+from collections import deque
+from datetime    import date
+from itertools   import count
+from operator    import attrgetter, and_, eq
+from time        import time
+from types       import MethodType
 
-__all__ = ['INSERT', 'DELETE', 'UPDATE', 'AttributeParser', 'StormAttributeParser', 
-           'simple', 'camelCase', 'CSV', 'CSVType', 'CSVStatement', 'StormORM', 'ORM']
+__all__ = ['INSERT', 'DELETE', 'UPDATE', 'UPSERT', 'AttributeParser', 'StormAttributeParser', 
+           'NULL', 'simple', 'camelCase', 'title', 'CSV', 'parseCSV', 'parseCSVParallel', 'CSVType', 'CSVStatement', 'StormORM', 'ORM',
+           'COMMIT_STATEMENT', 'COMMIT_TYPE', 'COMMIT_CSV', 'CLASS_CONVERTERS',
+           'ExecutionStats', 'clearHeaderCache', 'CSVFile', 'AsyncORM',
+           'ERRORS_PRINT', 'ERRORS_FAIL', 'ErrorLog', 'SQLAlchemyORM', 'DBAPIORM', 'SQLiteFastLoad']
 
 INSERT = '+'
 DELETE = '-'
 UPDATE = '~'
+UPSERT = '*'
+
+# field of a NULL value (None), written by export
+NULL = '\\N'
+
+# commit policies accepted by ORM.execute (an int N commits every N statements)
+COMMIT_STATEMENT = 'statement'
+COMMIT_TYPE      = 'type'
+COMMIT_CSV       = 'csv'
+
+# error policies accepted by ORM.execute (an ErrorLog skips and collects the failed statements)
+ERRORS_PRINT = 'print'
+ERRORS_FAIL  = 'fail'
+
+# converts the columns according to the types of the class attributes (see CSVType.createConverters)
+CLASS_CONVERTERS = 'class'
+
+SAVEPOINT = 'easycsv_statement'
+
+SQLITE_MAX_VARIABLES = 999
+
+# maximum number of header signatures kept by the CSVType header cache
+HEADER_CACHE_SIZE = 10000
+
+# header signature -> resolved CSVType attributes (see CSVType and clearHeaderCache)
+_headerCache = {}
 
 
 class AttributeParser(object):
@@ -77,10 +111,41 @@ class AttributeParser(object):
     Generic parser applied to column fields of a statements block.
     The methods used to parse column fields start with parse and receives two parameters:
     text to be parsed and match object of re module.
+    
+    The regexes of the parse methods are combined in a single regex, built once, whose 
+    alternatives are tried in the order of dir(). The match object given to a method is
+    the match of its own regex whenever it has groups.
     """
-    def __init__(self):
+    def __init__(self, cacheSize=0):
+        '''
+        @param cacheSize: The maximum number of parsed values memoized by text. Memoized 
+        values are shared, so parse methods must return immutable values when it is used. 
+        Zero disables the cache.
+        '''
         self.regexes = self.__createMethodAnalyzers()
+        self.regex, self.dispatch = self.__createDispatcher()
+        self.cacheSize = cacheSize
+        # the cache has two generations of at most cacheSize/2 values: when the recent
+        # one is full it replaces the old one, so the values used since the last 
+        # replacement are kept (an approximation of LRU with plain dicts)
+        self.cache = {}
+        self.oldCache = {}
         
+    def __getstate__(self):
+        # bound methods and compiled regexes are recreated, so parsers can be sent to 
+        # the processes of parseCSVParallel
+        state = self.__dict__.copy()
+        for name in ['regexes', 'regex', 'dispatch', 'cache', 'oldCache']:
+            state.pop(name, None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.regexes = self.__createMethodAnalyzers()
+        self.regex, self.dispatch = self.__createDispatcher()
+        self.cache = {}
+        self.oldCache = {}
+    
     def __createMethodAnalyzers(self):
         pairs = []
         for methodName in dir(self):
@@ -89,6 +154,18 @@ class AttributeParser(object):
                 pairs.append( (re.compile(method.__doc__), method) )
         return pairs
     
+    def __createDispatcher(self):
+        # each regex becomes a group of the combined regex, dispatch maps the group
+        # index to the pair (regex, method)
+        patterns = []
+        dispatch = {}
+        index = 1
+        for regex, method in self.regexes:
+            patterns.append('(%s)' % regex.pattern)
+            dispatch[index] = (regex, method)
+            index += regex.groups + 1
+        return re.compile('|'.join(patterns)), dispatch
+    
     def parse(self, text):
         '''
         Parse text elements according to its own parserXXX methods or
@@ -98,23 +175,102 @@ class AttributeParser(object):
         
         @return: parsed value of text
         '''
+        if not self.cacheSize:
+            return self._parse(text)
+        cache = self.cache
+        if text in cache:
+            return cache[text]
+        if text in self.oldCache:
+            result = self.oldCache[text]
+        else:
+            result = self._parse(text)
+        if len(cache) >= max(1, self.cacheSize/2):
+            self.oldCache = cache
+            cache = self.cache = {}
+        cache[text] = result
+        return result
+    
+    def _parse(self, text):
+        if text == NULL:
+            return None
         result = None
-        for regex, func in self.regexes:
-            match = regex.match(text)
-            if match:
-                result = func(text, match)
-                break
+        match = self.regex.match(text)
+        if match:
+            regex, func = self.dispatch[match.lastindex]
+            if regex.groups:
+                match = regex.match(text)
+            result = func(text, match)
         if result is None:
             result = self.parseAny(text)
         return result
     
+    def converter(self, cls, attrName):
+        '''
+        Returns the function that converts the column fields of the attribute attrName 
+        of cls according to its type, or None if its type is unknown.
+        The generic parser knows no types.
+        '''
+        return None
+    
+    def sampleConverter(self, texts):
+        '''
+        Returns the function that converts the fields of a column whose sampled texts 
+        were all parsed by the same parse method, or None. The function calls that 
+        method directly when its regex matches and falls back to parse otherwise.
+        
+        @param texts: sampled texts of a column.
+        '''
+        indexes = set()
+        for text in texts:
+            match = self.regex.match(text)
+            indexes.add(match and match.lastindex)
+        if len(indexes) is not 1 or None in indexes:
+            return None
+        regex, func = self.dispatch[indexes.pop()]
+        parse = self.parse
+        def convert(text):
+            match = regex.match(text)
+            if match:
+                result = func(text, match)
+                if result is not None:
+                    return result
+            return parse(text)
+        return convert
+    
+    def format(self, value):
+        '''
+        Returns the text of a column field that parse converts back to value, 
+        the inverse of parse. Texts that would be parsed as another value are 
+        escaped with a leading quote, and None is formatted as NULL.
+        
+        @param value: value to be formatted
+        
+        @return: text of value
+        '''
+        if value is None:
+            return NULL
+        elif value is True or value is False:
+            return str(value).lower()
+        elif isinstance(value, (int, long, float)):
+            return repr(value)
+        elif isinstance(value, unicode):
+            text = value.encode('utf-8')
+        else:
+            text = str(value)
+        if self.parse(text) != value:
+            text = "'" + text
+        return text
+    
     def parseNumber(self, text, match):
-        r'^-?\s*\d+([\.,]\d+)?$'
-        return eval(text)
+        r'^-?\s*\d+(?:[\.,]\d+)?$'
+        text = ''.join(text.split())
+        if text.isdigit() or text[1:].isdigit():
+            return int(text)
+        return float(text.replace(',', '.'))
     
     def parseBoolean(self, text, match):
-        r'^[Tt][Rr][Uu][eE]|[Ff][Aa][Ll][Ss][Ee]$'
-        return eval(text.lower().capitalize())
+        r'^(?:[Tt][Rr][Uu][eE]|[Ff][Aa][Ll][Ss][Ee])$'
+        return text[0] in 'Tt'
     
     def parseText(self, text, match):
         r'^\''
@@ -129,8 +285,11 @@ class StormAttributeParser(AttributeParser):
     Implementation of parser for storm ORM. It generates unicode strings and
     parses dd-mm-yyyy to datetime.date objects.
     """
-    def __init__(self):
-        super(StormAttributeParser, self).__init__()
+    # dsr -- date separator regex
+    dsr = re.compile(r'[/.-]')
+    
+    def __init__(self, cacheSize=0):
+        super(StormAttributeParser, self).__init__(cacheSize=cacheSize)
     
     def parseText(self, text, match):
         r'^\''
@@ -140,15 +299,59 @@ class StormAttributeParser(AttributeParser):
     
     def parseDate(self, text, match):
         r'^\d?\d[/.-]\d\d[/.-]\d\d\d\d$'
-        # dsr -- date separator regex
-        dsr = re.compile(r'[/.-]')
         # dp -- date parts
-        dp = dsr.split(text)
+        dp = self.dsr.split(text)
         return date( int(dp[2]), int(dp[1]), int(dp[0]) )
     
     def parseAny(self, text):
         return unicode(text.decode('utf-8'))
     
+    def format(self, value):
+        '''
+        Formats dates as dd/mm/yyyy, see AttributeParser.format.
+        '''
+        if type(value) is date:
+            return '%02d/%02d/%04d' % (value.day, value.month, value.year)
+        return super(StormAttributeParser, self).format(value)
+    
+    def converter(self, cls, attrName):
+        '''
+        Returns the function that converts the column fields of the attribute attrName 
+        of cls according to the type of its storm column (Int, Float, Bool, Unicode and Date), 
+        or None for other types. NULL fields are converted to None, and so are empty fields, 
+        except for Unicode.
+        '''
+        from storm.variables import IntVariable, FloatVariable, BoolVariable, UnicodeVariable, DateVariable
+        column = getColumn(cls, attrName)
+        if column is None:
+            return None
+        variable = getattr(column.variable_factory, 'func', None)
+        if variable is UnicodeVariable:
+            parseText, parseAny = self.parseText, self.parseAny
+            return lambda text: None if text == NULL else \
+                parseText(text, None) if text.startswith("'") else parseAny(text)
+        elif variable is IntVariable:
+            convert = lambda text: int(''.join(text.split()))
+        elif variable is FloatVariable:
+            convert = lambda text: float(''.join(text.split()).replace(',', '.'))
+        elif variable is BoolVariable:
+            convert = self.toBoolean
+        elif variable is DateVariable:
+            parseDate = self.parseDate
+            convert = lambda text: parseDate(text, None)
+        else:
+            return None
+        return lambda text: convert(text) if text and text != NULL else None
+    
+    def toBoolean(self, text):
+        '''Converts true or false, in any case, to bool.'''
+        value = text.lower()
+        if value == 'true':
+            return True
+        elif value == 'false':
+            return False
+        raise ValueError('Invalid boolean: %s' % text)
+    
 
 def simple(attrName):
     '''
@@ -185,6 +388,268 @@ def camelCase(attrName):
         else:
             s.append(part.capitalize())
     return ''.join(s)
+
+
+def title(attrName):
+    '''
+    Convert property names, in lower case with underscores or in camel case, to human 
+    readable header names, the inverse of simple and camelCase.
+    Examples:
+
+    >>> title("bank_account")
+    'Bank Account'
+    >>> title("bankAccount")
+    'Bank Account'
+    '''
+    attrName = re.sub('([a-z0-9])([A-Z])', r'\1 \2', attrName)
+    return ' '.join(part.capitalize() for part in re.split('[_\s]+', attrName) if part)
+    
+
+
+class ExecutionStats(object):
+    """
+    Statistics of the execution of csv statements, filled by ORM.execute when it is 
+    given as its stats parameter:
+        - times: wall time, in seconds, spent at each phase of PHASES
+        - rows: dict mapping the csv type names to the lists [inserted, updated, deleted, total]
+        - statements: total statements executed
+        - queries: total queries sent to the database, when the ORM counts them
+        - elapsed: wall time of the whole execution
+    
+    The phases are:
+        - tokenize: reading csv rows
+        - header: creating CSVType objects (importClass, name resolution, converters)
+        - parse: converting the fields of the statements
+        - execute: executing the statements, including lookup
+        - lookup: retrieving the objects of update and delete statements
+        - flush: sending the changes to the database
+        - commit: committing transactions
+    """
+    PHASES = ['tokenize', 'header', 'parse', 'execute', 'lookup', 'flush', 'commit']
+    
+    def __init__(self):
+        self.times = dict.fromkeys(self.PHASES, 0.0)
+        self.rows = {}
+        self.statements = 0
+        self.queries = 0
+        self.elapsed = 0.0
+    
+    def add(self, phase, start):
+        '''Adds the time elapsed since start, a time.time() value, to phase.'''
+        self.times[phase] += time() - start
+    
+    def timeIterator(self, phase, iterable):
+        '''Iterates over iterable adding the time spent by each step to phase.'''
+        iterator = iter(iterable)
+        while True:
+            start = time()
+            try:
+                item = iterator.next()
+            finally:
+                self.add(phase, start)
+            yield item
+    
+    def count(self, typeName, action, n):
+        '''Adds n rows affected by a statement of typeName with the given action.'''
+        rows = self.rows.setdefault(typeName, [0, 0, 0, 0])
+        rows[[INSERT, UPDATE, DELETE].index(action)] += n
+        rows[3] += n
+    
+    def rowsPerSecond(self):
+        if not self.elapsed:
+            return 0.0
+        return self.statements / self.elapsed
+    
+    def __str__(self):
+        lines = ['%d statements in %.3fs (%.1f statements/s), %d queries' % 
+                 (self.statements, self.elapsed, self.rowsPerSecond(), self.queries)]
+        for phase in self.PHASES:
+            lines.append('  %-10s %10.3fs' % (phase, self.times[phase]))
+        for typeName, (i, u, d, t) in sorted(self.rows.items()):
+            lines.append('  %s: %d inserted, %d updated, %d deleted' % (typeName, i, u, d))
+        return '\n'.join(lines)
+    
+
+
+class ErrorLog(object):
+    """
+    Error policy of ORM.execute that skips the failed statements and collects them in 
+    rejected, a list of (csvType, csvStatement, exception) triples. When a deadLetter file 
+    is given the failed statements are also written to it as csv statements, preceded 
+    by the header of their block and by a comment with the error, so that it can be 
+    fixed and executed again.
+    """
+    def __init__(self, deadLetter=None):
+        '''
+        @param deadLetter: A file object where the failed statements are written.
+        '''
+        self.rejected = []
+        self.deadLetter = deadLetter
+        self.writer = deadLetter and csv.writer(deadLetter)
+        self.header = None
+    
+    def add(self, csvType, csvStatement, exception):
+        '''Collects a failed statement.'''
+        self.rejected.append( (csvType, csvStatement, exception) )
+        if not self.writer:
+            return
+        if csvType is not self.header:
+            if self.header:
+                self.writer.writerow([])
+            self.writer.writerow(csvType.lineContent.split(','))
+            self.header = csvType
+        self.writer.writerow(['# line %s: %s' % (csvStatement.lineNumber, 
+                                                 str(exception).replace('\n', ' '))])
+        self.writer.writerow(csvStatement.csvRow)
+    
+    def __len__(self):
+        return len(self.rejected)
+    
+
+
+class SQLiteFastLoad(object):
+    """
+    Fast-load mode of ORM.execute for SQLite databases. During the execution the 
+    journal_mode, synchronous and cache_size pragmas are changed and, optionally, 
+    the secondary indexes are dropped; they are rebuilt in the transaction of the 
+    final commit and the pragmas are restored at the end.
+    
+    Without journal and synchronous writes a crash during the load may corrupt the 
+    database, so it is meant for loads that can be repeated from scratch.
+    """
+    def __init__(self, journalMode='MEMORY', synchronous='OFF', cacheSize=-65536, dropIndexes=False):
+        '''
+        @param journalMode: The journal_mode used during the load.
+        @param synchronous: The synchronous setting used during the load.
+        @param cacheSize: The cache_size used during the load, negative values are KiB.
+        @param dropIndexes: True drops the indexes created with CREATE INDEX of all tables, 
+        a list of table names drops the ones of these tables. Unique indexes are only 
+        checked when they are rebuilt, so lookups by key (updates, deletes, upserts and 
+        sync) are slower and duplicates make the final commit fail.
+        '''
+        self.journalMode = journalMode
+        self.synchronous = synchronous
+        self.cacheSize = cacheSize
+        self.dropIndexes = dropIndexes
+        self.saved = None
+        self.indexes = []
+    
+    def start(self, execute):
+        '''
+        Saves and changes the pragmas and drops the indexes, outside of a transaction.
+        
+        @param execute: A function that executes a SQL statement in the connection of 
+        the ORM and returns its rows.
+        '''
+        self.saved = [(pragma, execute('PRAGMA %s' % pragma)[0][0]) 
+                      for pragma in ['journal_mode', 'synchronous', 'cache_size']]
+        execute('PRAGMA journal_mode = %s' % self.journalMode)
+        execute('PRAGMA synchronous = %s' % self.synchronous)
+        execute('PRAGMA cache_size = %d' % self.cacheSize)
+        if self.dropIndexes:
+            tables = self.dropIndexes is not True and [t.lower() for t in self.dropIndexes]
+            rows = execute("SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+            for name, table, sql in rows:
+                if not tables or table.lower() in tables:
+                    execute('DROP INDEX %s' % name)
+                    self.indexes.append( (name, sql) )
+    
+    def rebuildIndexes(self, execute):
+        '''
+        Rebuilds the dropped indexes that don't exist, called in the transaction of 
+        the final commit.
+        '''
+        existing = set(name for name, in execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        for name, sql in self.indexes:
+            if name not in existing:
+                execute(sql)
+    
+    def stop(self, execute):
+        '''
+        Rebuilds the indexes lost by a rolled back load and restores the pragmas, 
+        outside of a transaction.
+        '''
+        try:
+            self.rebuildIndexes(execute)
+            self.indexes = []
+        finally:
+            for pragma, value in self.saved or []:
+                execute('PRAGMA %s = %s' % (pragma, value))
+            self.saved = None
+    
+
+
+class CSVFile(object):
+    """
+    Iterable over the lines of a csv statements file, read with mmap or with a large 
+    buffer, so that big files aren't loaded into memory. It can be used as the content 
+    of CSV, parseCSV and ORM.execute.
+    
+    The lines can be read from any offset, like the ones returned by blockOffsets, 
+    the statements parsed keep the line numbers of the file. Each iteration reads 
+    the lines from offset, which isn't changed, so a CSVFile can be read many times.
+    
+    >>> orm.execute(CSVFile('statements.csv'))
+    """
+    def __init__(self, path, offset=0, lineNumber=0, bufferSize=1024*1024, useMmap=False):
+        '''
+        @param path: The path of the file.
+        @param offset: The offset of the first line read, in bytes.
+        @param lineNumber: The number of lines before offset.
+        @param bufferSize: The size of the buffer used to read the file.
+        @param useMmap: If True the file is read with mmap.
+        '''
+        self.path = path
+        self.offset = offset
+        self.lineNumber = lineNumber
+        self.bufferSize = bufferSize
+        self.useMmap = useMmap
+    
+    def __iter__(self):
+        if self.useMmap:
+            return self._mmapLines()
+        return self._bufferedLines()
+    
+    def _bufferedLines(self):
+        f = open(self.path, 'rb', self.bufferSize)
+        try:
+            f.seek(self.offset)
+            for line in iter(f.readline, ''):
+                yield line
+        finally:
+            f.close()
+    
+    def _mmapLines(self):
+        import mmap
+        f = open(self.path, 'rb')
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if self.offset >= size:
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                start = self.offset
+                while start < size:
+                    end = data.find('\n', start)
+                    end = end == -1 and size or end + 1
+                    yield data[start:end]
+                    start = end
+            finally:
+                data.close()
+        finally:
+            f.close()
+    
+    def blockOffsets(self):
+        '''
+        Generator of the (offset, lineNumber) pairs of the headers of the statement blocks
+        after offset, that can be used to create CSVFile objects that start at them.
+        '''
+        offset, lineNumber = self.offset, self.lineNumber
+        for line in self:
+            if line.lstrip()[:1].isalpha():
+                yield offset, lineNumber
+            offset += len(line)
+            lineNumber += 1
     
 
 
@@ -192,34 +657,334 @@ class CSV(object):
     """CSV class that handles the csv files
     content is any iterable where the content of each row is data delimited text.
     """
-    def __init__(self, content, attrParser=AttributeParser(), modName=None, module=None, nameResolution=simple):
+    def __init__(self, content, attrParser=AttributeParser(), modName=None, module=None, nameResolution=simple, 
+                 converters=None, processes=0):
         '''
-        @param content: The csv content in one of following types: str, file or any iterable that iterate over csv lines.
+        @param content: The csv content in one of following types: str, file, CSVFile or any iterable 
+        that iterate over csv lines.
         @param attrParser: Any class that inherits AttributeParser.
         @param modName: The name of the module where classes declared in the header of a statement block.
         @param module: the module where classes declared in the header of a statement block.
         @param nameResolution: The function used to resolve the column's names in the header of a statement block.
+        @param converters: How the column fields are converted: None parses each field with attrParser, 
+        CLASS_CONVERTERS converts each column according to the type of the class attribute and an int N 
+        converts each column with the parse method that parsed its N first fields (see CSVType.createConverters).
+        @param processes: The number of processes used to parse the statements (see parseCSVParallel), 
+        zero parses them in the calling process.
         '''
-        if type(content) is str:
-            import os
-            content = content.split(os.linesep)
-        
         self.types = []
-        for i, csvRow in enumerate(csv.reader(content)):
+        for csvType, statement in iterCSV(content, attrParser=attrParser, modName=modName, module=module, 
+                                          nameResolution=nameResolution, converters=converters, 
+                                          processes=processes):
+            if statement is None:
+                self.types.append(csvType)
+            else:
+                csvType.addStatement(statement)
+    
+    def iterStatements(self):
+        '''
+        Iterates over the statements of all csv types following the protocol of parseCSV.
+        '''
+        for csvType in self.types:
+            yield csvType, None
+            for statement in csvType.statements:
+                yield csvType, statement
+    
+
+
+def parseCSV(content, attrParser=AttributeParser(), modName=None, module=None, nameResolution=simple, 
+             converters=None, stats=None, skipLines=0):
+    '''
+    Generator that parses the csv content row by row, so that the statements can be 
+    executed as they are read, without keeping them in memory.
+    
+    It yields the pair (csvType, None) when the header of a statement block is read and 
+    the pair (csvType, csvStatement) for each statement of that block. The statements are 
+    not added to csvType.statements.
+    
+    @param stats: An ExecutionStats that receives the time spent at each phase of parsing.
+    @param skipLines: The statements of the first skipLines lines are skipped without 
+    converting their fields, the headers are still read (see ORM.execute checkpoint).
+    
+    The other parameters are the same of CSV.
+    '''
+    if type(content) is str:
+        content = content.split(os.linesep)
+    
+    def newStatement(i, csvRow):
+        if stats:
+            start = time()
+        statement = _newStatement(csvRow, attrParser, csvType.converters, i+1)
+        if stats:
+            stats.add('parse', start)
+        return statement
+    
+    def flushSample():
+        if sample:
+            csvType.createConverters(attrParser, sample=[csvRow for i, csvRow in sample])
+        for i, csvRow in sample:
+            yield csvType, newStatement(i, csvRow)
+        del sample[:]
+    
+    # content that starts in the middle of a file (like CSVFile) tells its first line number
+    firstLine = getattr(content, 'lineNumber', 0)
+    rows = csv.reader(content)
+    if stats:
+        rows = stats.timeIterator('tokenize', rows)
+    
+    csvType = None
+    sampling = False
+    sample = []
+    for i, csvRow in enumerate(rows, firstLine):
+        csvRow = [f.strip() for f in csvRow]
+        if len(csvRow) is 0 or csvRow[0] in ['#', '']:
+            continue
+        elif csvRow[0] in '+-~*':
+            if i < skipLines:
+                continue
+            if sampling:
+                sample.append( (i, csvRow) )
+                if len(sample) >= converters:
+                    sampling = False
+                    for pair in flushSample():
+                        yield pair
+                continue
+            yield csvType, newStatement(i, csvRow)
+        elif csvRow[0][0].isalpha():
+            for pair in flushSample():
+                yield pair
+            if stats:
+                start = time()
+            csvType = CSVType(csvRow, nameResolution=nameResolution, modName=modName, module=module)
+            csvType.lineNumber = i+1
+            csvType.lineContent = ','.join(csvRow)
+            if converters == CLASS_CONVERTERS:
+                csvType.createConverters(attrParser)
+            if stats:
+                stats.add('header', start)
+            sampling = type(converters) is int
+            yield csvType, None
+    for pair in flushSample():
+        yield pair
+
+
+def iterCSV(content, processes=0, **kwargs):
+    '''
+    Returns the generator parseCSVParallel if processes is given, otherwise parseCSV.
+    '''
+    if processes:
+        return parseCSVParallel(content, processes=processes, **kwargs)
+    return parseCSV(content, **kwargs)
+
+
+def parseCSVParallel(content, attrParser=AttributeParser(), modName=None, module=None, nameResolution=simple, 
+                     converters=None, processes=None, chunkSize=1000, stats=None, skipLines=0):
+    '''
+    Generator that works like parseCSV but converts the fields of the statements in a 
+    pool of processes. The rows are read by the calling process and sent to the pool in
+    chunks of rows of the same block; the statements are yielded in their original order.
+    
+    The classes declared in the headers must be importable by the pool processes and 
+    attrParser must be picklable. When converters is an int the converters are created 
+    from the first rows of each chunk.
+    
+    @param processes: The number of processes of the pool, defaults to the number of cpus.
+    @param chunkSize: The maximum number of rows sent to a process at once.
+    @param stats: An ExecutionStats, the time spent waiting for the pool is added to 
+    the parse phase.
+    
+    The other parameters are the same of CSV.
+    '''
+    from multiprocessing import Pool, cpu_count
+    if type(content) is str:
+        content = content.split(os.linesep)
+    processes = processes or cpu_count()
+    
+    pool = Pool(processes, _initParserProcess, (attrParser,))
+    # pending is the queue of (csvType, result) pairs, result is None for headers, its 
+    # size is limited to keep the memory bounded
+    pending = deque()
+    def submit(csvType, chunk):
+        pending.append( (csvType, pool.apply_async(_parseChunk, (csvType, converters, chunk))) )
+    def flush(size):
+        while len(pending) > size:
+            csvType, result = pending.popleft()
+            if result is None:
+                yield csvType, None
+            else:
+                if stats:
+                    start = time()
+                statements = result.get()
+                if stats:
+                    stats.add('parse', start)
+                for statement in statements:
+                    yield csvType, statement
+    
+    # content that starts in the middle of a file (like CSVFile) tells its first line number
+    firstLine = getattr(content, 'lineNumber', 0)
+    rows = csv.reader(content)
+    if stats:
+        rows = stats.timeIterator('tokenize', rows)
+    
+    try:
+        csvType = None
+        chunk = []
+        for i, csvRow in enumerate(rows, firstLine):
             csvRow = [f.strip() for f in csvRow]
             if len(csvRow) is 0 or csvRow[0] in ['#', '']:
                 continue
-            elif csvRow[0] in '+-~':
-                statement = CSVStatement(csvRow, attrParser)
-                statement.lineNumber = i+1
-                statement.lineContent = ','.join(csvRow)
-                csvType.addStatement( statement )
+            elif csvRow[0] in '+-~*':
+                if i < skipLines:
+                    continue
+                chunk.append( (i, csvRow) )
+                if len(chunk) >= chunkSize:
+                    submit(csvType, chunk)
+                    chunk = []
+                    for pair in flush(2*processes):
+                        yield pair
             elif csvRow[0][0].isalpha():
+                if chunk:
+                    submit(csvType, chunk)
+                    chunk = []
+                    for pair in flush(2*processes):
+                        yield pair
+                if stats:
+                    start = time()
                 csvType = CSVType(csvRow, nameResolution=nameResolution, modName=modName, module=module)
                 csvType.lineNumber = i+1
                 csvType.lineContent = ','.join(csvRow)
-                self.types.append(csvType)
+                if stats:
+                    stats.add('header', start)
+                pending.append( (csvType, None) )
+                for pair in flush(2*processes):
+                    yield pair
+        if chunk:
+            submit(csvType, chunk)
+        for pair in flush(0):
+            yield pair
+        pool.close()
+    finally:
+        pool.terminate()
+
+
+_processParser = None
+
+def _initParserProcess(attrParser):
+    global _processParser
+    _processParser = attrParser
+
+
+def _parseChunk(csvType, converters, chunk):
+    '''Creates the statements of a chunk of rows in a process of parseCSVParallel.'''
+    if converters == CLASS_CONVERTERS:
+        csvType.createConverters(_processParser)
+    elif type(converters) is int:
+        csvType.createConverters(_processParser, sample=[csvRow for i, csvRow in chunk[:converters]])
+    statements = []
+    for i, csvRow in chunk:
+        statements.append(_newStatement(csvRow, _processParser, csvType.converters, i+1))
+    return statements
+
+
+def _newStatement(csvRow, attrParser, converters, lineNumber):
+    '''
+    Creates the CSVStatement of a row. The statement of a row whose fields can't be 
+    converted keeps the exception raised in its error attribute, without values, so that 
+    it is handled by the error policy of the execution instead of ending the parsing.
+    '''
+    try:
+        statement = CSVStatement(csvRow, attrParser, converters)
+    except Exception, ex:
+        statement = CSVStatement(csvRow[:1], attrParser)
+        statement.csvRow = csvRow
+        statement.error = ex
+    statement.lineNumber = lineNumber
+    return statement
+
+
+def batchStatements(statements, batchSize):
+    '''
+    Groups consecutive statements of the same csvType and the same action in lists
+    with at most batchSize statements.
+    
+    @param statements: iterator of (csvType, csvStatement) pairs, as produced by parseCSV.
+    @param batchSize: The maximum number of statements in a batch.
     
+    @return: Generator of (csvType, batch) pairs, where batch is None for the pairs 
+    that announce a statement block.
+    '''
+    csvType, batch = None, []
+    for typo, statement in statements:
+        if batch and (statement is None or typo is not csvType or 
+                      statement.action is not batch[0].action or len(batch) >= batchSize):
+            yield csvType, batch
+            batch = []
+        if statement is None:
+            yield typo, None
+        else:
+            csvType = typo
+            batch.append(statement)
+    if batch:
+        yield csvType, batch
+
+
+def prefetchStatements(statements, size):
+    '''
+    Generator that iterates over statements in another thread, keeping at most about 
+    size (csvType, csvStatement) pairs in a bounded queue ahead of the consumer, so that 
+    the next statements are parsed while the current ones are executed. The pairs are 
+    queued in chunks to reduce the locking. The exceptions raised by statements are 
+    raised by the generator.
+    
+    @param statements: iterator of (csvType, csvStatement) pairs, as produced by parseCSV.
+    @param size: The maximum number of pairs in the queue.
+    '''
+    import sys, threading
+    from Queue import Queue, Full
+    chunkSize = max(1, min(100, size))
+    queue = Queue(max(1, size/chunkSize))
+    stopped = threading.Event()
+    
+    def put(item):
+        # gives up when the consumer stops before the end of statements
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+    
+    def produce():
+        try:
+            chunk = []
+            for pair in statements:
+                chunk.append(pair)
+                if len(chunk) >= chunkSize:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            if chunk and not put(chunk):
+                return
+            put(None)
+        except:
+            put(sys.exc_info())
+    
+    producer = threading.Thread(target=produce)
+    producer.setDaemon(True)
+    producer.start()
+    try:
+        for item in iter(queue.get, None):
+            if type(item) is tuple:
+                raise item[0], item[1], item[2]
+            for pair in item:
+                yield pair
+    finally:
+        stopped.set()
+        # the generator may be collected by the producer, when it drops the last reference
+        if producer is not threading.current_thread():
+            producer.join()
+
 
 
 class CSVType(object):
@@ -234,10 +999,34 @@ class CSVType(object):
         @param nameResolution: The function used to resolve the column's names in the header of a statement block.
         '''
         self.typeName = fields[0]
+        self.statements = []
+        self.converters = {}
+        # a repeated header is resolved once per process, except the tables of a DBAPIORM 
+        # that would keep its connection open
+        signature = None
+        if not isinstance(module, DBAPITables):
+            signature = (tuple(fields), nameResolution, modName, module)
+        try:
+            resolved = signature and _headerCache.get(signature)
+        except TypeError:
+            signature = resolved = None
+        if resolved:
+            self.type, keys, attributes, self.hasPrimaryKey, self.primaryKey = resolved
+            self.keys = dict(keys)
+            self.attributes = dict(attributes)
+            return
+        self._resolve(fields, nameResolution, modName, module)
+        if signature:
+            if len(_headerCache) >= HEADER_CACHE_SIZE:
+                _headerCache.clear()
+            _headerCache[signature] = (self.type, dict(self.keys), dict(self.attributes), 
+                                       self.hasPrimaryKey, self.primaryKey)
+    
+    def _resolve(self, fields, nameResolution, modName, module):
+        '''Resolves the class, the keys and the attributes of the header fields.'''
         self.type = importClass(self.typeName, modName=modName, module=module)
         self.keys = {}
         self.attributes = {}
-        self.statements = []
         self.hasPrimaryKey = False
         self.primaryKey = None
                 
@@ -261,39 +1050,160 @@ class CSVType(object):
             if self.primaryKey[0] in self.attributes:
                 del self.attributes[ self.primaryKey[0] ]
     
+    def __getstate__(self):
+        # statements and converters aren't sent to the processes of parseCSVParallel
+        state = self.__dict__.copy()
+        state['statements'] = []
+        state['converters'] = {}
+        return state
+    
     def addStatement(self, statement):
         self.statements.append(statement)
     
+    def createConverters(self, attrParser, sample=None):
+        '''
+        Creates the converters used by the statements of this block to convert column fields, 
+        instead of parsing them with attrParser.parse. Columns without converter are parsed.
+        
+        @param attrParser: Any class that inherits AttributeParser.
+        @param sample: A list of csv rows (with the action at the first column). When it is 
+        given the converters are created by attrParser.sampleConverter from the fields of 
+        each column, otherwise by attrParser.converter from the class attributes.
+        '''
+        self.converters = {}
+        names = self.keys.items() + self.attributes.items()
+        for i, name in names:
+            if sample is None:
+                converter = attrParser.converter(self.type, name)
+            else:
+                converter = attrParser.sampleConverter([row[i] for row in sample if len(row) > i])
+            if converter:
+                self.converters[i] = converter
+    
 
 
 class CSVStatement(object):
     """
     CSVStatement represents the csv statement to be executed by a ORM.
+    
+    The converted fields are kept in the tuple values, indexed by column like 
+    the csv row, so values[0] is the action. lineContent is joined from the csv 
+    row only when it is read, usually by an error message. error is the exception 
+    raised converting the fields of a statement created by the parsers, which isn't 
+    executed.
     """
-    def __init__(self, csvRow, attrParser):
+    __slots__ = ('action', 'csvRow', 'values', 'lineNumber', 'error', '_lineContent')
+    
+    def __init__(self, csvRow, attrParser, converters=None):
         '''
         @param csvRow: A list with the splited content of a text csv row.
         @param attrParser: Any class that inherits AttributeParser.
+        @param converters: A dict mapping column indexes to the functions used to convert 
+        their fields instead of attrParser.parse (see CSVType.createConverters).
         '''
         self.action = csvRow[0]
         self.csvRow = csvRow
-        self.attributes = {}
-        for i, field in zip(count(1), csvRow[1:]):
-            self.attributes[i] = attrParser.parse(field)
+        self.lineNumber = None
+        self.error = None
+        self._lineContent = None
+        parse = attrParser.parse
+        if converters:
+            get = converters.get
+            self.values = (self.action,) + tuple([(get(i) or parse)(field) 
+                                                  for i, field in zip(count(1), csvRow[1:])])
+        else:
+            self.values = (self.action,) + tuple(map(parse, csvRow[1:]))
+    
+    def __getstate__(self):
+        return self.action, self.csvRow, self.values, self.lineNumber, self.error, self._lineContent
+    
+    def __setstate__(self, state):
+        self.action, self.csvRow, self.values, self.lineNumber, self.error, self._lineContent = state
+    
+    def _getLineContent(self):
+        if self._lineContent is None:
+            return ','.join(self.csvRow)
+        return self._lineContent
+    
+    def _setLineContent(self, lineContent):
+        self._lineContent = lineContent
+    
+    lineContent = property(_getLineContent, _setLineContent)
+    
+    def _getAttributes(self):
+        return dict(zip(count(1), self.values[1:]))
+    
+    def _setAttributes(self, attributes):
+        values = [None] * (max([0] + list(attributes)) + 1)
+        values[0] = self.action
+        for i, value in attributes.iteritems():
+            values[i] = value
+        self.values = tuple(values)
+    
+    # dict mapping column indexes to the converted fields, built from values
+    attributes = property(_getAttributes, _setAttributes)
     
 
 
 class ORM(object):
     """The ORM engine super class."""
-    def execute(self, csv, attrParser=None, modName=None, module=None, nameResolution=simple):
+    # the ExecutionStats of the running execution
+    stats = None
+    # the checkpoint file of the running execution
+    checkpoint = None
+    # the error policy of the running execution
+    errors = ERRORS_PRINT
+    # the SQLiteFastLoad of the running execution
+    fastLoad = None
+    # whether the references of the statements are validated (see validateReferences)
+    checkReferences = False
+    # referenced class and column -> keys of the rows known to exist, cached by 
+    # validateReferences during the execution
+    parentKeys = None
+    
+    def execute(self, csv, attrParser=None, modName=None, module=None, nameResolution=simple, 
+                commit=COMMIT_STATEMENT, batchSize=1, converters=None, processes=0, stats=None, 
+                sync=False, deleteMissing=False, checkpoint=None, prefetch=0, errors=ERRORS_PRINT, 
+                fastLoad=None, checkReferences=False):
         """
-        Creates the CSV object with csv types and csv statements and sends the CSV to be executed
-        by the proper ORM.
+        Executes the csv statements by the proper ORM.
+        When csv is not a CSV object its statements are executed as they are parsed, 
+        keeping only the current statement in memory.
         
+        @param csv: A CSV object or the csv content accepted by CSV.
         @param attrParser: Any class that inherits AttributeParser.
         @param modName: The name of the module where classes declared in the header of a statement block.
         @param module: the module where classes declared in the header of a statement block.
         @param nameResolution: The function used to resolve the column's names in the header of a statement block.
+        @param converters: How the column fields are converted (see CSV).
+        @param processes: The number of processes used to parse the statements (see CSV).
+        @param stats: An ExecutionStats filled with the statistics of the execution.
+        @param sync: If True only the statements that change the database are executed 
+        (see syncStatements).
+        @param deleteMissing: If True the rows missing from the statement blocks are deleted
+        when sync is used. It can't be used with checkpoint, since the rows of the statements 
+        skipped by a resumed load would be missing.
+        @param checkpoint: The path of a file where the line of the last committed statement 
+        is written after each commit. If the file exists the load is resumed: the statements 
+        until that line are skipped without being converted. The file is removed when the 
+        execution ends without errors.
+        @param prefetch: If greater than zero, the statements are parsed in another thread, 
+        at most prefetch statements ahead of the execution (see prefetchStatements).
+        @param errors: The error policy for failed statements: ERRORS_PRINT prints the 
+        ValueErrors (like statements without rows to update) and raises other exceptions, 
+        ERRORS_FAIL raises any exception and an ErrorLog skips and collects all of them.
+        Raised exceptions end the execution after rolling back the statements executed 
+        since the last commit, so that each transaction of the commit policy is atomic.
+        @param fastLoad: A SQLiteFastLoad, or True for the default one, executes the whole 
+        csv in a single transaction (COMMIT_CSV) with the fast-load settings.
+        @param checkReferences: If True the rows referenced by the statements are checked 
+        before each batch is executed (see validateReferences), the statements that 
+        reference missing rows fail with a ValueError.
+        @param commit: The commit policy: COMMIT_STATEMENT (one transaction per statement), 
+        COMMIT_TYPE (one transaction per statement block), COMMIT_CSV (one transaction for 
+        the whole csv) or an int N (one transaction every N statements).
+        @param batchSize: The maximum number of consecutive statements of the same block and 
+        action executed together by executeBatch, e.g. in a single multi-row insert.
         
         @return: Return a 4-tuple that indicates:
             - total rows inserted
@@ -305,90 +1215,578 @@ class ORM(object):
         
         if not attrParser:
             attrParser = self.attrParser
-            
-        if type(csv) is not CSV:
-            csv = CSV(csv, attrParser=attrParser, modName=modName, module=module, nameResolution=nameResolution)
         
-        return self._execute(csv)
+        if sync and deleteMissing and checkpoint:
+            raise ValueError('deleteMissing can\'t be used with checkpoint')
+        skipLines = checkpoint and readCheckpoint(checkpoint) or 0
+        if type(csv) is CSV:
+            statements = csv.iterStatements()
+            if skipLines:
+                statements = ((t, s) for t, s in statements if s is None or s.lineNumber > skipLines)
+        else:
+            statements = iterCSV(csv, attrParser=attrParser, modName=modName, module=module, 
+                                 nameResolution=nameResolution, converters=converters, processes=processes, 
+                                 stats=stats, skipLines=skipLines)
+        if prefetch:
+            statements = prefetchStatements(statements, prefetch)
+        statements = self._rejectFailed(statements)
+        if sync:
+            statements = self.syncStatements(statements, deleteMissing=deleteMissing)
+        
+        if errors not in (ERRORS_PRINT, ERRORS_FAIL) and not isinstance(errors, ErrorLog):
+            raise ValueError('Invalid error policy: %r' % (errors,))
+        if fastLoad:
+            if fastLoad is True:
+                fastLoad = SQLiteFastLoad()
+            commit = COMMIT_CSV
+        self.stats = stats
+        self.checkpoint = checkpoint
+        self.errors = errors
+        self.fastLoad = fastLoad
+        self.checkReferences = checkReferences
+        self.parentKeys = {}
+        if stats:
+            self.startStats(stats)
+            start = time()
+        try:
+            if fastLoad:
+                self.commit()
+                fastLoad.start(self.sqliteExecute)
+            result = self._execute(statements, commit=commit, batchSize=batchSize)
+        finally:
+            if stats:
+                stats.elapsed += time() - start
+                self.stopStats(stats)
+            self.stats = None
+            self.checkpoint = None
+            self.errors = ERRORS_PRINT
+            self.fastLoad = None
+            self.checkReferences = False
+            self.parentKeys = None
+            if fastLoad:
+                # discards the load if it failed
+                self.rollback()
+                fastLoad.stop(self.sqliteExecute)
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        return result
             
-    def _execute(self, csv):
-        """Executes all statements of a CSV object.
+    def _execute(self, statements, commit=COMMIT_STATEMENT, batchSize=1):
+        """Executes all statements given by an iterator of (csvType, csvStatement) pairs, 
+        as produced by parseCSV or CSV.iterStatements.
         
-        @param csv: CSV object.
+        Each batch of statements runs inside a savepoint, so a failed batch is rolled back
+        alone and the statements already executed in the same transaction are kept.
+        A failed batch with many statements is split in halves that are executed again, 
+        until the failed statements are isolated and handled by the error policy (see execute); 
+        if the policy raises an exception the whole batch is rolled back.
+        Batches of upsert statements are split in insert and update batches by resolveUpserts.
+        If the error policy raises an exception the statements executed since the last 
+        commit, the one recorded by the checkpoint, are rolled back and it is propagated.
+        
+        @param statements: iterator of (csvType, csvStatement) pairs.
+        @param commit: The commit policy (see execute).
+        @param batchSize: The maximum number of statements in a batch (see execute).
         """
+        if commit not in (COMMIT_STATEMENT, COMMIT_TYPE, COMMIT_CSV) and \
+            not (type(commit) is int and commit > 0):
+            raise ValueError('Invalid commit policy: %r' % (commit,))
         i, d, u, t = 0, 0, 0, 0
-        for typo in csv.types:
-            for statement in typo.statements:
-                try:
-                    n = self.executeStatement(typo, statement)
+        pending = 0
+        # line of the last statement executed, written to the checkpoint at each commit
+        lastLine = 0
+        try:
+            for typo, batch in batchStatements(statements, batchSize):
+                if batch is None:
+                    if commit == COMMIT_TYPE and pending:
+                        self._commit(lastLine)
+                        pending = 0
+                    continue
+                line = batch[-1].lineNumber or 0
+                if self.checkReferences:
+                    batch = self._validateReferences(typo, batch)
+                if not batch:
+                    lastLine = max(lastLine, line)
+                    continue
+                if batch[0].action is UPSERT:
+                    batches = self.resolveUpserts(typo, batch)
+                else:
+                    batches = [batch]
+                for batch in batches:
+                    n = self._executeBatch(typo, batch)
                     t += n
-                    if statement.action is INSERT:
+                    action = batch[0].action
+                    if action is INSERT:
                         i += n
-                    elif statement.action is UPDATE:
+                    elif action is UPDATE:
                         u += n
-                    elif statement.action is DELETE:
+                    elif action is DELETE:
                         d += n
-                except ValueError, ex:
-                    print ex
+                    if self.stats:
+                        self.stats.statements += len(batch)
+                        self.stats.count(typo.typeName, action, n)
+                    pending += len(batch)
+                lastLine = max(lastLine, line)
+                if commit == COMMIT_STATEMENT or (type(commit) is int and pending >= commit):
+                    self._commit(lastLine)
+                    pending = 0
+        except:
+            # a fast load is a single transaction, rolled back as a whole by execute
+            if not self.fastLoad:
+                import sys
+                error = sys.exc_info()
+                self.rollback()
+                raise error[0], error[1], error[2]
+            raise
+        if pending:
+            self._commit(lastLine)
         return i, u, d, t
-
-
-
-class StormORM(ORM):
-    """
-    Storm implementation of ORM super class.
-    """
-    def __init__(self, uri=None, store=None):
-        '''
-        @param uri: Database URI following storm rules.
-        @param store: Storm store.
-        
-        If uri is given a new store is instanciated and it is used 
-        to execute the statements.
-        If both parameters are given the early created store overrides
-        the store given.
-        '''
-        from storm.locals import create_database, Store
-        self.uri = uri
-        self.store = store
-        if self.uri:
-            database = create_database(self.uri)
-            self.store = Store(database)
-        if not self.store:
-            raise Exception('None storm store')
-        self.attrParser = StormAttributeParser()
-            
-    def _getObject(self, csvType, csvStatement):
+    
+    def _executeBatch(self, csvType, batch):
         """
-        Retrieves the object to be used at statement execution.
-        
-        @param csvType: The CSVType
-        @param csvStatement: The CSVStatement
+        Executes a batch of statements inside a savepoint.
         
-        @return: The object early instanciated (for insert statement) or
-        retrieved from database (for update or delete statements).
+        @return: Total rows affected by the statements.
         """
-        typo = csvType.type
-        keys = csvType.keys
-        attributes = csvStatement.attributes
-        if csvStatement.action in [DELETE, UPDATE]:
-            if csvType.hasPrimaryKey:
-                return self.store.get(typo, attributes[ csvType.primaryKey[0] ])
-            else:
-                pred = And([Eq(typo, key, attributes[i]) for i,key in keys.iteritems()])
-                result = self.store.find(typo, pred)
-                if result.count() == 0:
-                    return None
-                elif result.count() == 1:
-                    return result.one()
-                else:
-                    return [r for r in result]
-        elif csvStatement.action is INSERT:
-            return typo()
+        stats = self.stats
+        self.savepoint()
+        try:
+            if stats:
+                start = time()
+            n = self.executeBatch(csvType, batch)
+            if stats:
+                stats.add('execute', start)
+                start = time()
+            self.releaseSavepoint()
+            if stats:
+                stats.add('flush', start)
+            return n
+        except Exception, ex:
+            self.rollbackToSavepoint()
+            if len(batch) is 1:
+                if not self._handleError(csvType, batch[0], ex):
+                    raise
+                return 0
+        except:
+            self.rollbackToSavepoint()
+            raise
+        # bisects the batch to isolate the failed statements, inside a savepoint that 
+        # discards the halves already executed if the error policy raises an exception, 
+        # since they aren't counted nor covered by the checkpoint
+        half = len(batch)/2
+        self.savepoint()
+        try:
+            n = self._executeBatch(csvType, batch[:half]) + self._executeBatch(csvType, batch[half:])
+        except:
+            self.rollbackToSavepoint()
+            raise
+        self.releaseSavepoint()
+        return n
     
-    def executeStatement(self, csvType, csvStatement):
+    def _rejectFailed(self, statements):
         """
-        Executes csv statements matched by the pair csvType, csvStatement.
+        Generator that filters the (csvType, csvStatement) pairs, handling the statements 
+        whose fields couldn't be converted (see CSVStatement.error) by the error policy.
+        """
+        for csvType, statement in statements:
+            if statement is not None and statement.error is not None:
+                if not self._handleError(csvType, statement, statement.error):
+                    raise statement.error
+                continue
+            yield csvType, statement
+    
+    def _handleError(self, csvType, csvStatement, exception):
+        """
+        Handles the exception raised by a statement according to the error policy.
+        
+        @return: False if the exception must be raised.
+        """
+        if isinstance(self.errors, ErrorLog):
+            self.errors.add(csvType, csvStatement, exception)
+        elif self.errors == ERRORS_PRINT and isinstance(exception, ValueError):
+            print exception
+        else:
+            return False
+        return True
+    
+    def _convertKeys(self, csvType, batch, keyValues):
+        """
+        Applies keyValues to each statement of a batch, handling the statements whose 
+        keys can't be converted according to the error policy.
+        
+        @return: List of (statement, key values) pairs of the other statements.
+        """
+        pairs = []
+        for statement in batch:
+            try:
+                pairs.append((statement, keyValues(statement)))
+            except Exception, ex:
+                if not self._handleError(csvType, statement, ex):
+                    raise
+        return pairs
+    
+    def _validateReferences(self, csvType, batch):
+        """
+        Removes from a batch the statements that reference missing rows (see 
+        validateReferences), handling their errors according to the error policy.
+        """
+        if self.stats:
+            start = time()
+        valid, invalid = self.validateReferences(csvType, batch)
+        if self.stats:
+            self.stats.add('lookup', start)
+        for statement, exception in invalid:
+            if not self._handleError(csvType, statement, exception):
+                raise exception
+        return valid
+    
+    def validateReferences(self, csvType, batch):
+        """
+        Checks whether the rows referenced by the statements of a batch exist, before 
+        executing them. ORM engines that know the references of the classes override it.
+        
+        @param csvType: The CSVType
+        @param batch: A list of CSVStatement
+        
+        @return: The pair (valid statements, list of (invalid statement, exception) pairs).
+        """
+        raise NotImplementedError('%s does not support reference validation' % type(self).__name__)
+    
+    def _commit(self, lastLine=0):
+        if self.fastLoad:
+            self.fastLoad.rebuildIndexes(self.sqliteExecute)
+        if self.stats:
+            start = time()
+            self.commit()
+            self.stats.add('commit', start)
+        else:
+            self.commit()
+        if self.checkpoint and lastLine:
+            writeCheckpoint(self.checkpoint, lastLine)
+    
+    def executeBatch(self, csvType, batch):
+        """
+        Executes a batch of statements of the same csvType and the same action.
+        ORM engines override it to execute the batch with less database round-trips.
+        
+        @param csvType: The CSVType
+        @param batch: A list of CSVStatement
+        
+        @return: Total rows affected by the statements.
+        """
+        return sum(self.executeStatement(csvType, statement) for statement in batch)
+    
+    def resolveUpserts(self, csvType, batch):
+        """
+        Resolves a batch of upsert statements into insert and update statements, 
+        according to the existence of rows with their keys. ORM engines that support 
+        upsert statements override it.
+        
+        @param csvType: The CSVType
+        @param batch: A list of upsert CSVStatement
+        
+        @return: A list of batches of insert or update statements.
+        """
+        raise NotImplementedError('%s does not support upsert statements' % type(self).__name__)
+    
+    def _splitUpserts(self, pairs, existing):
+        """
+        Splits upsert statements into the batch of update statements of the keys in 
+        existing and the batch of insert statements of the other keys, the first of 
+        each key, executed before the update statements (see resolveUpserts).
+        
+        @param pairs: List of (upsert statement, key values) pairs.
+        @param existing: The set of the key values of the rows in the database.
+        
+        @return: A list with the batch of insert statements and the batch of update 
+        statements, without the empty ones.
+        """
+        from copy import copy
+        inserts, updates = [], []
+        for statement, key in pairs:
+            statement = copy(statement)
+            if key in existing:
+                statement.action = UPDATE
+                updates.append(statement)
+            else:
+                statement.action = INSERT
+                inserts.append(statement)
+                existing.add(key)
+        return [b for b in (inserts, updates) if b]
+    
+    def commit(self):
+        """Commits the current transaction."""
+        pass
+    
+    def rollback(self):
+        """Rolls back the current transaction."""
+        pass
+    
+    def savepoint(self):
+        """
+        Opens a savepoint in the current transaction before a statement is executed.
+        Savepoints are nested while a failed batch is bisected.
+        """
+        pass
+    
+    def releaseSavepoint(self):
+        """Releases the savepoint after a statement is successfully executed."""
+        pass
+    
+    def rollbackToSavepoint(self):
+        """Discards the changes of a failed statement rolling back to its savepoint."""
+        pass
+    
+    def syncStatements(self, statements, deleteMissing=False):
+        """
+        Generator that filters (csvType, csvStatement) pairs, keeping only the statements 
+        that change the database: each block is taken as the state of the rows with its 
+        keys. ORM engines that can compare the statements with the database override it.
+        """
+        raise NotImplementedError('%s does not support sync' % type(self).__name__)
+    
+    def sqliteExecute(self, sql):
+        """
+        Executes sql in the SQLite connection of the ORM, without beginning a transaction, 
+        and returns its rows. ORM engines that support SQLiteFastLoad override it.
+        """
+        raise NotImplementedError('%s does not support fast load' % type(self).__name__)
+    
+    def startStats(self, stats):
+        """Starts collecting the statistics that only the ORM engine knows, like queries."""
+        pass
+    
+    def stopStats(self, stats):
+        """Stops collecting the statistics started by startStats."""
+        pass
+    
+    def executeConcurrently(self, csv, threads=4, attrParser=None, modName=None, module=None, 
+                            nameResolution=simple, commit=COMMIT_TYPE, batchSize=1, converters=None):
+        """
+        Executes the statement blocks of a csv concurrently in a pool of threads, each 
+        thread with its own ORM (see clone). Blocks whose classes are dependent (see dependent) are executed 
+        in the order they appear in the csv, the block executed last waits the other to be 
+        committed.
+        
+        @param threads: The maximum number of blocks executed at once.
+        
+        The other parameters and the return are the same of execute, the statements are 
+        committed at least at the end of each block.
+        """
+        import sys, threading
+        from Queue import Queue
+        
+        if type(threads) is not int or threads < 1:
+            raise ValueError('Invalid number of threads: %r' % (threads,))
+        if not attrParser:
+            attrParser = self.attrParser
+        if type(csv) is not CSV:
+            csv = CSV(csv, attrParser=attrParser, modName=modName, module=module, 
+                      nameResolution=nameResolution, converters=converters)
+        
+        blocks = csv.types
+        predecessors = [set(i for i in range(j) if self.dependent(blocks[i].type, blocks[j].type)) 
+                        for j in range(len(blocks))]
+        tasks, results = Queue(), Queue()
+        
+        def work():
+            # the ORM is created in the thread that uses it, since connections usually
+            # can't be shared by threads
+            engine = None
+            try:
+                for j in iter(tasks.get, None):
+                    typo = blocks[j]
+                    statements = [(typo, None)] + [(typo, statement) for statement in typo.statements]
+                    try:
+                        engine = engine or self.clone()
+                        r = engine._execute(engine._rejectFailed(statements), commit=commit, 
+                                            batchSize=batchSize)
+                        results.put( (j, r, None) )
+                    except:
+                        results.put( (j, None, sys.exc_info()) )
+            finally:
+                if engine:
+                    engine.close()
+        
+        workers = [threading.Thread(target=work) for k in range(min(threads, len(blocks)))]
+        for worker in workers:
+            worker.start()
+        
+        total = [0, 0, 0, 0]
+        waiting = range(len(blocks))
+        done = set()
+        error = None
+        running = 0
+        try:
+            while running or (waiting and not error):
+                for j in list(waiting):
+                    if running < len(workers) and not error and predecessors[j] <= done:
+                        waiting.remove(j)
+                        tasks.put(j)
+                        running += 1
+                j, r, exc = results.get()
+                running -= 1
+                if exc:
+                    error = error or exc
+                else:
+                    done.add(j)
+                    total = [a + b for a, b in zip(total, r)]
+        finally:
+            for worker in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+        if error:
+            raise error[0], error[1], error[2]
+        return tuple(total)
+    
+    def executeFiles(self, files, threads=0, attrParser=None, modName=None, module=None, 
+                     nameResolution=simple, converters=None, processes=0, **kwargs):
+        """
+        Executes the statement blocks of many csv files in one pass, with the blocks 
+        of each class executed after the blocks of the classes it references (see 
+        dependencyOrder), whatever the order of the files.
+        
+        @param files: A list of csv files: the paths of the files, or iterables of lines 
+        accepted by CSV such as open files. Strings are always taken as paths, the csv 
+        content of a string must be wrapped, e.g. by StringIO or splitlines.
+        @param threads: If greater than zero, the blocks are executed by executeConcurrently, 
+        so that the blocks of independent classes are executed together.
+        
+        The other parameters are the same of execute (or executeConcurrently, when threads 
+        are used), and so is the return, except checkpoint: the line numbers of the files 
+        overlap, so an execution of many files can't be resumed.
+        """
+        if kwargs.get('checkpoint'):
+            raise ValueError('A checkpoint can not resume the execution of many files')
+        if not attrParser:
+            attrParser = self.attrParser
+        types = []
+        for content in files:
+            if isinstance(content, basestring):
+                content = CSVFile(content)
+            types += CSV(content, attrParser=attrParser, modName=modName, module=module, 
+                         nameResolution=nameResolution, converters=converters, processes=processes).types
+        csv = CSV([])
+        csv.types = self.dependencyOrder(types)
+        if threads:
+            return self.executeConcurrently(csv, threads=threads, **kwargs)
+        return self.execute(csv, **kwargs)
+    
+    def dependencyOrder(self, types):
+        """
+        Groups statement blocks by class and sorts the groups so that each class follows 
+        the classes it references (see references). The blocks of a group and the groups 
+        without dependencies between them keep the order they appear; classes that 
+        reference each other in a cycle are also kept in that order.
+        
+        @param types: A list of CSVType.
+        
+        @return: The list of CSVType sorted.
+        """
+        classes, groups = [], {}
+        for csvType in types:
+            if csvType.type not in groups:
+                classes.append(csvType.type)
+                groups[csvType.type] = []
+            groups[csvType.type].append(csvType)
+        
+        predecessors = dict((cls, set(other for other in classes 
+                                      if other is not cls and self.references(cls, other)))
+                            for cls in classes)
+        ordered = []
+        while classes:
+            done = set(ordered)
+            ready = [cls for cls in classes if predecessors[cls] <= done] or classes[:1]
+            for cls in ready:
+                classes.remove(cls)
+                ordered.append(cls)
+        return [csvType for cls in ordered for csvType in groups[cls]]
+    
+    def clone(self):
+        """Returns a new ORM of the same kind with its own connection to the database."""
+        raise NotImplementedError('%s does not support concurrent execution' % type(self).__name__)
+    
+    def close(self):
+        """Closes the connection of an ORM created by clone."""
+        pass
+    
+    def dependent(self, cls1, cls2):
+        """
+        Checks whether the statements of two classes can't be executed concurrently.
+        The ORM super class doesn't know the relations of the classes, so all classes 
+        are dependent.
+        """
+        return True
+    
+    def references(self, cls1, cls2):
+        """
+        Checks whether the rows of cls1 reference rows of cls2, so that the statements 
+        of cls2 are executed first by executeFiles. The ORM super class doesn't know the 
+        relations of the classes, so no class references other.
+        """
+        return False
+
+
+
+class StormORM(ORM):
+    """
+    Storm implementation of ORM super class.
+    """
+    # begins the transactions of SQLite stores with BEGIN IMMEDIATE (see clone)
+    immediate = False
+    
+    def __init__(self, uri=None, store=None):
+        '''
+        @param uri: Database URI following storm rules.
+        @param store: Storm store.
+        
+        If uri is given a new store is instanciated and it is used 
+        to execute the statements.
+        If both parameters are given the early created store overrides
+        the store given.
+        '''
+        from storm.locals import create_database, Store
+        self.uri = uri
+        self.store = store
+        if self.uri:
+            database = create_database(self.uri)
+            self.store = Store(database)
+        if not self.store:
+            raise Exception('None storm store')
+        self.attrParser = StormAttributeParser()
+            
+    def _getObject(self, csvType, csvStatement):
+        """
+        Retrieves the object to be used at statement execution.
+        
+        @param csvType: The CSVType
+        @param csvStatement: The CSVStatement
+        
+        @return: The object early instanciated (for insert statement) or
+        retrieved from database (for update or delete statements).
+        """
+        typo = csvType.type
+        keys = csvType.keys
+        attributes = csvStatement.values
+        if csvStatement.action in [DELETE, UPDATE]:
+            if csvType.hasPrimaryKey:
+                return self.store.get(typo, attributes[ csvType.primaryKey[0] ])
+            else:
+                pred = And([Eq(typo, key, attributes[i]) for i,key in keys.iteritems()])
+                result = self.store.find(typo, pred)
+                if result.count() == 0:
+                    return None
+                elif result.count() == 1:
+                    return result.one()
+                else:
+                    return [r for r in result]
+        elif csvStatement.action is INSERT:
+            return typo()
+    
+    def executeStatement(self, csvType, csvStatement):
+        """
+        Executes csv statements matched by the pair csvType, csvStatement.
         
         @param csvType: The CSVType
         @param csvStatement: The CSVStatement
@@ -396,7 +1794,14 @@ class StormORM(ORM):
         @return: Total statements executed or raises a ValueError if the object retrieved with
         the pair csvType, csvStatement is None.
         """
-        obj = self._getObject(csvType, csvStatement)
+        if csvStatement.action is not INSERT and self._setColumns(csvType):
+            return self._executeSet(csvType, csvStatement)
+        if self.stats and csvStatement.action is not INSERT:
+            start = time()
+            obj = self._getObject(csvType, csvStatement)
+            self.stats.add('lookup', start)
+        else:
+            obj = self._getObject(csvType, csvStatement)
         
         if not obj:
             msg = 'Statement return None in line %d: %s' % (csvStatement.lineNumber, csvStatement.lineContent)
@@ -425,7 +1830,7 @@ class StormORM(ORM):
         """
         keys = csvType.keys
         attributes = csvType.attributes
-        values = csvStatement.attributes
+        values = csvStatement.values
         if csvStatement.action is INSERT:
             pairs = [(key, values[i]) for i,key in keys.iteritems()]
             pairs += [(key, values[i]) for i,key in attributes.iteritems()]
@@ -438,8 +1843,700 @@ class StormORM(ORM):
                 setattr(obj, key, value)
         elif csvStatement.action is DELETE:
             self.store.remove(obj)
+    
+    def _setColumns(self, csvType):
+        """
+        Checks whether the update and delete statements of csvType can be executed as 
+        set operations (see _executeSet): blocks with keys that are not the primary 
+        key, of classes accepted by isBulkUpdatable, with all attributes bound to columns.
+        
+        @return: The pair (key columns, attribute columns) as lists of (column index, column) 
+        pairs or None.
+        """
+        if csvType.hasPrimaryKey or not csvType.keys or not isBulkUpdatable(csvType.type):
+            return None
+        keys = [(i, getColumn(csvType.type, name)) for i, name in csvType.keys.iteritems()]
+        attributes = [(i, getColumn(csvType.type, name)) for i, name in csvType.attributes.iteritems()]
+        if [column for i, column in keys + attributes if column is None]:
+            return None
+        return keys, attributes
+    
+    def _executeSet(self, csvType, csvStatement):
+        """
+        Executes an update or delete statement with a single UPDATE ... WHERE or 
+        DELETE ... WHERE, without loading the matched objects. The cached objects 
+        of the class table are invalidated once per batch by executeBatch.
+        
+        @return: Total rows affected by the statement or raises a ValueError if no 
+        row matches the keys of the statement.
+        """
+        from storm.expr import Update
+        from storm.info import get_cls_info
+        keys, attributes = self._setColumns(csvType)
+        values = csvStatement.values
+        where = And([eq(column, values[i]) for i, column in keys])
+        result = self.store.find(csvType.type, where)
+        if csvStatement.action is DELETE:
+            n = result.remove()
+        elif not attributes:
+            n = result.count()
+        else:
+            # ResultSet.set isn't used since it searches the cache for each statement, 
+            # the variables set None as NULL
+            changes = dict((column, column.variable_factory(value=values[i])) for i, column in attributes)
+            update = Update(changes, where, get_cls_info(csvType.type).table)
+            n = self.store.execute(update).rowcount
+        if not n:
+            msg = 'Statement return None in line %d: %s' % (csvStatement.lineNumber, csvStatement.lineContent)
+            raise ValueError(msg)
+        return n
+    
+    def executeBatch(self, csvType, batch):
+        """
+        Executes a batch of statements. Insert statements of classes accepted by 
+        isBulkInsertable are executed with multi-row inserts, bypassing the 
+        creation of objects. Update and delete statements of blocks with keys that 
+        aren't the primary key are set operations (see _executeSet), the objects of 
+        the other ones are retrieved with one query for each chunk of statements 
+        (see _findObjects).
+        
+        @param csvType: The CSVType
+        @param batch: A list of CSVStatement
+        
+        @return: Total rows affected by the statements.
+        """
+        if batch[0].action is INSERT and len(batch) > 1 and isBulkInsertable(csvType.type):
+            names = csvType.keys.items() + csvType.attributes.items()
+            columns = [getColumn(csvType.type, name) for i, name in names]
+            # columns overload ==, so None can't be searched with in
+            if not [column for column in columns if column is None]:
+                return self._bulkInsert(csvType, batch, names, columns)
+        elif batch[0].action in [DELETE, UPDATE] and len(batch) > 1 and not self._setColumns(csvType):
+            if self.stats:
+                start = time()
+            index = self._findObjects(csvType, batch)
+            if self.stats:
+                self.stats.add('lookup', start)
+            if index is not None:
+                return self._executeIndexed(csvType, batch, index)
+        elif batch[0].action in [DELETE, UPDATE] and self._setColumns(csvType):
+            try:
+                return super(StormORM, self).executeBatch(csvType, batch)
+            finally:
+                # searching the changed objects in the cache for each statement would 
+                # reload the objects invalidated by the previous ones, so all of them 
+                # are invalidated at once
+                self._invalidateTable(csvType.type)
+        return super(StormORM, self).executeBatch(csvType, batch)
+    
+    def _invalidateTable(self, cls):
+        """
+        Invalidates the alive objects of the classes mapped to the table of cls, so that 
+        they are reloaded when used. Storm only invalidates one object or all of them.
+        """
+        from storm.info import get_cls_info
+        table = get_cls_info(cls).table.name
+        for objInfo in self.store._iter_alive():
+            obj = objInfo.get_obj()
+            if obj is not None and objInfo.cls_info.table.name == table:
+                self.store.invalidate(obj)
+    
+    def _bulkInsert(self, csvType, batch, names, columns):
+        """
+        Inserts the rows of a batch of insert statements with multi-row 
+        INSERT ... VALUES statements into the table of the csvType class.
+        
+        @param names: list of (column index, attribute name) pairs.
+        @param columns: list with the storm column of each attribute in names.
+        """
+        from storm.expr import Insert
+        from storm.info import get_cls_info
+        # keeps the number of parameters of each insert under the sqlite limit (999)
+        size = max(1, SQLITE_MAX_VARIABLES/len(columns))
+        table = get_cls_info(csvType.type).table
+        for j in xrange(0, len(batch), size):
+            rows = []
+            for statement in batch[j:j+size]:
+                values = statement.values
+                rows.append(tuple(column.variable_factory(value=values[i]) 
+                                  for column, (i, name) in zip(columns, names)))
+            self.store.execute(Insert(columns, table=table, values=rows), noresult=True)
+        return len(batch)
+    
+    def _findObjects(self, csvType, batch):
+        """
+        Retrieves the objects matched by the keys of a batch of statements, with 
+        one query (key IN (...) or an OR of the composite keys) for each chunk of 
+        distinct keys.
+        
+        @return: dict mapping key values (see _keyValues) to lists of objects, or 
+        None if some key isn't bound to a column.
+        """
+        from storm.info import get_obj_info
+        typo = csvType.type
+        keys = csvType.keys.items()
+        columns = [getColumn(typo, name) for i, name in keys]
+        if [column for column in columns if column is None]:
+            return None
+        
+        values, seen = [], set()
+        for statement in batch:
+            key = self._keyValues(keys, columns, statement)
+            if key not in seen:
+                seen.add(key)
+                values.append(key)
+        
+        index = {}
+        size = max(1, SQLITE_MAX_VARIABLES/len(columns))
+        for j in xrange(0, len(values), size):
+            pred = self._keyPredicate(columns, values[j:j+size])
+            for obj in self.store.find(typo, pred):
+                variables = get_obj_info(obj).variables
+                key = tuple(variables[column].get() for column in columns)
+                index.setdefault(key, []).append(obj)
+        return index
+    
+    def _keyPredicate(self, columns, keyValues):
+        """
+        Returns the predicate matching any of the keyValues tuples: key IN (...) 
+        for a single column key or an OR of the composite keys.
+        """
+        from storm.expr import In, Or
+        if len(columns) is 1:
+            return In(columns[0], [key[0] for key in keyValues])
+        return Or(*[And([eq(c, v) for c, v in zip(columns, key)]) for key in keyValues])
+    
+    def resolveUpserts(self, csvType, batch):
+        """
+        Resolves a batch of upsert statements with one query for each chunk of 
+        distinct keys, that retrieves the keys already in the database. The 
+        statements of the other keys become insert statements, the first of each 
+        key, executed before the update statements.
+        
+        @return: A list with the batch of insert statements and the batch of update 
+        statements, without the empty ones.
+        """
+        self._beginImmediate()
+        if self.stats:
+            start = time()
+        typo = csvType.type
+        keys = csvType.keys.items()
+        columns = [getColumn(typo, name) for i, name in keys]
+        if not keys or [column for column in columns if column is None]:
+            msg = 'Upsert statements without keys bound to columns in line %d: %s' % \
+                (csvType.lineNumber, csvType.lineContent)
+            raise ValueError(msg)
+        
+        pairs = self._convertKeys(csvType, batch, lambda statement: self._keyValues(keys, columns, statement))
+        values = list(set(key for statement, key in pairs))
+        existing = set()
+        size = max(1, SQLITE_MAX_VARIABLES/len(columns))
+        for j in xrange(0, len(values), size):
+            result = self.store.find(typo, self._keyPredicate(columns, values[j:j+size]))
+            for key in result.values(*columns):
+                existing.add(len(columns) is 1 and (key,) or tuple(key))
+        
+        if self.stats:
+            self.stats.add('lookup', start)
+        return self._splitUpserts(pairs, existing)
+    
+    def _keyValues(self, keys, columns, csvStatement):
+        """
+        Returns the tuple of key values of a statement converted by the key columns, 
+        so that they compare to the values loaded from database.
+        """
+        values = csvStatement.values
+        return tuple(column.variable_factory(value=values[i]).get() 
+                     for column, (i, name) in zip(columns, keys))
+    
+    def _executeIndexed(self, csvType, batch, index):
+        """
+        Executes a batch of update or delete statements with the objects 
+        retrieved by _findObjects.
+        
+        @return: Total rows affected by the statements.
+        """
+        keys = csvType.keys.items()
+        columns = [getColumn(csvType.type, name) for i, name in keys]
+        n = 0
+        for statement in batch:
+            key = self._keyValues(keys, columns, statement)
+            objs = index.get(key)
+            if not objs:
+                msg = 'Statement return None in line %d: %s' % (statement.lineNumber, statement.lineContent)
+                raise ValueError(msg)
+            for obj in objs:
+                self._executeStatement(obj, csvType, statement)
+                n += 1
+            if statement.action is DELETE:
+                del index[key]
+        return n
+    
+    def syncStatements(self, statements, deleteMissing=False):
+        """
+        Generator that filters (csvType, csvStatement) pairs, keeping only the statements 
+        that change the database.
+        
+        When the first statement of a block is read the rows of its class are loaded into 
+        an index that maps the values of the block keys to the values of its attributes, 
+        with a single query that doesn't load objects. Insert and update statements become:
+            - insert statements if the key is not in the index
+            - update statements if some attribute changed, storm only updates the changed columns
+            - nothing otherwise
+        Delete statements are kept. If deleteMissing is True, delete statements are created 
+        at the end of each block for the keys of the index that weren't in the block.
+        
+        @param statements: iterator of (csvType, csvStatement) pairs.
+        @param deleteMissing: If True the rows missing from a block are deleted.
+        """
+        from copy import copy
+        csvType, index, seen = None, None, None
+        for typo, statement in statements:
+            if statement is None:
+                if deleteMissing and index is not None:
+                    for missing in self._missingStatements(csvType, index, seen):
+                        yield csvType, missing
+                csvType, index, seen = typo, None, set()
+                yield typo, None
+                continue
+            if index is None:
+                # the index is loaded after the previous block was executed
+                keys, keyColumns, attributes, columns, index = self._loadIndex(typo)
+            try:
+                key = self._keyValues(keys, keyColumns, statement)
+                if statement.action is not DELETE:
+                    values = self._keyValues(attributes, columns, statement)
+            except Exception, ex:
+                if not self._handleError(typo, statement, ex):
+                    raise
+                continue
+            seen.add(key)
+            if statement.action is DELETE:
+                index.pop(key, None)
+                yield typo, statement
+                continue
+            if key not in index:
+                if statement.action is not INSERT:
+                    statement = copy(statement)
+                    statement.action = INSERT
+            elif index[key] != values:
+                if statement.action is not UPDATE:
+                    statement = copy(statement)
+                    statement.action = UPDATE
+            else:
+                continue
+            index[key] = values
+            yield typo, statement
+        if deleteMissing and index is not None:
+            for missing in self._missingStatements(csvType, index, seen):
+                yield csvType, missing
+    
+    def validateReferences(self, csvType, batch):
+        """
+        Checks the references of the insert, update and upsert statements of a batch 
+        in memory, with the keys of the referenced rows cached in parentKeys for the 
+        whole execution: the keys not cached yet are retrieved with one query for each 
+        referenced class and chunk of keys. The rows of the same class inserted by the 
+        batch are also valid references. Delete statements discard the cached keys of 
+        their class. The headers may name the references or their foreign key columns.
+        
+        @return: The pair (valid statements, list of (invalid statement, exception) pairs).
+        """
+        from storm.expr import In
+        self._beginImmediate()
+        typo = csvType.type
+        if batch[0].action is DELETE:
+            for key in [key for key in self.parentKeys if key[0] is typo]:
+                del self.parentKeys[key]
+            return batch, []
+        
+        names = sorted(csvType.keys.items() + csvType.attributes.items())
+        columns = dict((id(getColumn(typo, name)), i) for i, name in names)
+        # foreign key columns named directly, like the headers written by export
+        byColumn = referencesByColumn(typo)
+        invalid = {}
+        for i, name in names:
+            reference = getattr(typo, name)
+            if not isReference(reference):
+                reference = byColumn.get(id(getColumn(typo, name)))
+                if reference is None:
+                    continue
+            remoteCls = reference._relation.remote_cls
+            remoteColumn = reference._relation.remote_key[0]
+            known = self.parentKeys.setdefault((remoteCls, remoteColumn.name), set())
+            convert = lambda value: remoteColumn.variable_factory(value=value).get()
+            # rows of the same class inserted by the batch
+            k = None
+            if remoteCls is typo and batch[0].action is not UPDATE and id(remoteColumn) in columns:
+                k = columns[id(remoteColumn)]
+            values, pending = {}, set()
+            for statement in batch:
+                if id(statement) in invalid:
+                    continue
+                try:
+                    values[id(statement)] = convert(statement.values[i])
+                    if k is not None:
+                        pending.add(convert(statement.values[k]))
+                except Exception, ex:
+                    # values that can't be converted are invalid references as well
+                    invalid[id(statement)] = (statement, ex)
+            missing = list(set(values.itervalues()) - known - set([None]))
+            size = SQLITE_MAX_VARIABLES
+            for j in xrange(0, len(missing), size):
+                result = self.store.find(remoteCls, In(remoteColumn, missing[j:j+size]))
+                known.update(result.values(remoteColumn))
+            for statement in batch:
+                value = values.get(id(statement))
+                if value is not None and value not in known and value not in pending:
+                    msg = 'Missing %s %r referenced by %s in line %d: %s' % (remoteCls.__name__, value, name, 
+                        statement.lineNumber, statement.lineContent)
+                    invalid.setdefault(id(statement), (statement, ValueError(msg)))
+        if not invalid:
+            return batch, []
+        valid = [statement for statement in batch if id(statement) not in invalid]
+        return valid, [invalid[id(statement)] for statement in batch if id(statement) in invalid]
+    
+    def _loadIndex(self, csvType):
+        """
+        Loads the index used by syncStatements.
+        
+        @return: 5-tuple with the keys of csvType, as (column index, name) pairs, their 
+        columns, the attributes of csvType, their columns and the index.
+        """
+        keys = sorted(csvType.keys.items())
+        keyColumns = [getColumn(csvType.type, name) for i, name in keys]
+        attributes = sorted(csvType.attributes.items())
+        attrColumns = [getColumn(csvType.type, name) for i, name in attributes]
+        if not keys or [c for c in keyColumns + attrColumns if c is None]:
+            msg = 'Statement block without keys or with attributes not bound to columns in line %d: %s' % \
+                (csvType.lineNumber, csvType.lineContent)
+            raise ValueError(msg)
+        self._beginImmediate()
+        columns = keyColumns + attrColumns
+        index = {}
+        for values in self.store.find(csvType.type).values(*columns):
+            if len(columns) is 1:
+                values = (values,)
+            index[tuple(values[:len(keys)])] = tuple(values[len(keys):])
+        return keys, keyColumns, attributes, attrColumns, index
+    
+    def _missingStatements(self, csvType, index, seen):
+        """Creates the delete statements of the keys of index that weren't seen."""
+        keys = sorted(csvType.keys)
+        for key in index:
+            if key not in seen:
+                statement = CSVStatement([DELETE], self.attrParser)
+                statement.attributes = dict(zip(keys, key))
+                statement.lineNumber = csvType.lineNumber
+                statement.lineContent = 'missing row of %s: %s' % (csvType.lineContent, key)
+                yield statement
+    
+    def export(self, cls, result=None, attributes=None, nameResolution=simple, chunkSize=1000):
+        """
+        Exports objects as a statement block of insert statements.
+        
+        The rows are fetched in chunks of chunkSize rows, ordered by the primary key and 
+        restricted to the keys after the last row of the previous chunk, so that no cursor 
+        is kept open and tables of any size are exported in constant memory. Classes with 
+        composite primary keys are fetched with a single query.
+        
+        @param cls: The class of the exported objects.
+        @param result: A storm result set of cls, e.g. store.find(cls, ...), defaults to 
+        all objects of cls.
+        @param attributes: The names of the exported attributes, defaults to all columns 
+        with the primary key first.
+        @param nameResolution: The function used to resolve the column's names in the header
+        of the statement block when it is executed. The header names are made with title 
+        if it resolves them back to the attribute names.
+        @param chunkSize: The number of rows fetched by each query.
+        
+        @return: Generator of csv rows (lists of fields), the header first, that can be 
+        written by a csv.writer.
+        
+        >>> csv.writer(open('category.csv', 'w')).writerows(orm.export(Category))
+        """
+        from storm.expr import Undef
+        from storm.info import get_cls_info
+        clsInfo = get_cls_info(cls)
+        primaryKey = set(id(column) for column in clsInfo.primary_key)
+        if attributes is None:
+            names = sorted(clsInfo.attributes)
+            attributes = [name for name in names if id(clsInfo.attributes[name]) in primaryKey]
+            attributes += [name for name in names if id(clsInfo.attributes[name]) not in primaryKey]
+        columns = [getColumn(cls, name) for name in attributes]
+        
+        header = ['%s.%s' % (cls.__module__, cls.__name__)]
+        for name in attributes:
+            if nameResolution(title(name)) == name:
+                header.append(title(name))
+            else:
+                header.append(name)
+        yield header
+        
+        if result is None:
+            result = self.store.find(cls)
+        format = self.attrParser.format
+        if len(clsInfo.primary_key) is not 1:
+            for values in result.values(*columns):
+                if len(columns) is 1:
+                    values = (values,)
+                yield [INSERT] + [format(value) for value in values]
+            return
+        
+        key = clsInfo.primary_key[0]
+        last = Undef
+        while True:
+            if last is Undef:
+                chunk = result.find()
+            else:
+                chunk = result.find(key > last)
+            rows = list(chunk.order_by(key).config(limit=chunkSize).values(key, *columns))
+            for values in rows:
+                yield [INSERT] + [format(value) for value in values[1:]]
+            if len(rows) < chunkSize:
+                break
+            last = rows[-1][0]
+    
+    def startStats(self, stats):
+        """Installs a storm tracer that counts the queries of the store."""
+        from storm.tracer import install_tracer
+        self._tracer = QueryCounter(self.store, stats)
+        install_tracer(self._tracer)
+    
+    def stopStats(self, stats):
+        from storm.tracer import remove_tracer
+        remove_tracer(self._tracer)
+        self._tracer = None
+    
+    def clone(self):
+        """
+        Returns a StormORM with a new store of the same database. In-memory SQLite 
+        databases can't be cloned, since each store would have its own empty database.
+        """
+        from storm.locals import Store
+        database = self.store.get_database()
+        # checked with a store of its own, since connections are bound to the thread 
+        # that opens them and the clone may be used by other thread
+        check = StormORM(store=Store(database))
+        try:
+            files = [row[2] for row in check._sqliteRawExecute('PRAGMA database_list') if row[1] == 'main']
+        except NotImplementedError:
+            files = None
+        finally:
+            check.close()
+        if files == ['']:
+            raise NotImplementedError('In-memory SQLite databases can\'t be cloned, use a database file')
+        orm = StormORM(store=Store(database))
+        orm.attrParser = self.attrParser
+        # clones run concurrently with other stores of the same database
+        orm.immediate = True
+        return orm
+    
+    def close(self):
+        """Closes the store."""
+        self.store.close()
+    
+    def dependent(self, cls1, cls2):
+        """
+        Checks whether two classes are mapped to the same table or one of them 
+        references the other.
+        """
+        return cls1.__storm_table__ == cls2.__storm_table__ or \
+            cls2 in referencedClasses(cls1) or cls1 in referencedClasses(cls2)
+    
+    def references(self, cls1, cls2):
+        """Checks whether cls1 has a storm reference to cls2."""
+        return cls2 in referencedClasses(cls1)
+    
+    def commit(self):
+        """Commits the store."""
         self.store.commit()
     
+    def rollback(self):
+        """Rolls back the store."""
+        self.store.rollback()
+    
+    def savepoint(self):
+        """Opens a savepoint in the store's transaction."""
+        self._beginImmediate()
+        self.store.execute('SAVEPOINT %s' % SAVEPOINT, noresult=True)
+    
+    def sqliteExecute(self, sql):
+        """
+        Executes sql in the raw connection of the store, so that storm doesn't begin 
+        a transaction, and returns its rows.
+        """
+        return self._sqliteRawExecute(sql)
+    
+    def _beginImmediate(self):
+        """
+        Begins the store's transaction with BEGIN IMMEDIATE on SQLite when immediate is 
+        set, so that concurrent stores wait for the write lock before reading, instead of 
+        deadlocking when two transactions that have read try to write. It is called 
+        before the queries that may begin a transaction: savepoints and the lookups 
+        done before them (resolveUpserts, validateReferences and syncStatements).
+        """
+        if not self.immediate:
+            return
+        try:
+            self._sqliteRawExecute('BEGIN IMMEDIATE', begin=True)
+        except NotImplementedError:
+            pass
+    
+    def _sqliteRawExecute(self, sql, begin=False):
+        """
+        Executes sql in the raw connection of a SQLite store, bypassing storm, and returns 
+        its rows. It is the only method that uses the private attributes of storm's 
+        SQLiteConnection.
+        
+        @param begin: If True sql begins the transaction of the store: it is only executed 
+        when storm isn't in a transaction, which is then marked as begun.
+        
+        @raise NotImplementedError: If the store isn't of a SQLite database.
+        """
+        from storm.databases.sqlite import SQLiteConnection
+        connection = self.store._connection
+        if not isinstance(connection, SQLiteConnection):
+            raise NotImplementedError('%s needs a SQLite database' % sql.split()[0])
+        if begin and connection._in_transaction:
+            return []
+        connection._ensure_connected()
+        rows = connection._raw_connection.execute(sql).fetchall()
+        if begin:
+            connection._in_transaction = True
+        return rows
+    
+    def releaseSavepoint(self):
+        """
+        Flushes the objects changed by the statement, so that database errors are 
+        raised at the statement that caused them, and releases the savepoint.
+        """
+        self.store.flush()
+        self.store.execute('RELEASE SAVEPOINT %s' % SAVEPOINT, noresult=True)
+    
+    def rollbackToSavepoint(self):
+        """
+        Rolls back to the savepoint and resets the store, dropping the objects 
+        changed by the failed statement from the store's cache.
+        """
+        self.store.block_implicit_flushes()
+        try:
+            self.store.execute('ROLLBACK TO SAVEPOINT %s' % SAVEPOINT, noresult=True)
+            self.store.execute('RELEASE SAVEPOINT %s' % SAVEPOINT, noresult=True)
+        finally:
+            self.store.unblock_implicit_flushes()
+        self.store.reset()
+    
+
+
+class QueryCounter(object):
+    """Storm tracer that counts the queries executed by a store."""
+    def __init__(self, store, stats):
+        '''
+        @param store: Storm store.
+        @param stats: The ExecutionStats whose queries are counted.
+        '''
+        self.connection = store._connection
+        self.stats = stats
+    
+    def connection_raw_execute(self, connection, raw_cursor, statement, params):
+        if connection is self.connection:
+            self.stats.queries += 1
+    
+
+
+class AsyncORM(object):
+    """
+    Executes loads in background threads, so that the caller, like the event loop of 
+    a service, isn't blocked while the statements are executed. Each load runs in its 
+    own thread with a clone of the ORM (see ORM.clone), while its statements are parsed 
+    in another thread through a bounded queue (see prefetchStatements).
+    
+    Since each load has its own connection, SQLite databases must be files.
+    
+    >>> loads = AsyncORM(StormORM('sqlite:statements.db'))
+    >>> result = loads.execute(CSVFile('statements.csv'), commit=COMMIT_TYPE)
+    >>> result.result()
+    (2, 0, 0, 2)
+    """
+    def __init__(self, orm, queueSize=1000):
+        '''
+        @param orm: The ORM cloned by each load.
+        @param queueSize: The maximum number of statements parsed ahead of the execution.
+        '''
+        self.orm = orm
+        self.queueSize = queueSize
+    
+    def execute(self, csv, callback=None, **kwargs):
+        '''
+        Starts the execution of csv in a new thread.
+        
+        @param csv: A CSV object or the csv content accepted by CSV.
+        @param callback: A function called with the AsyncResult when the execution 
+        ends, from the thread of the load.
+        
+        The other parameters are the same of ORM.execute.
+        
+        @return: An AsyncResult.
+        '''
+        import sys, threading
+        kwargs.setdefault('prefetch', self.queueSize)
+        result = AsyncResult()
+        
+        def load():
+            engine = None
+            try:
+                try:
+                    engine = self.orm.clone()
+                    result.value = engine.execute(csv, **kwargs)
+                except:
+                    result.excInfo = sys.exc_info()
+            finally:
+                if engine:
+                    engine.close()
+                result.event.set()
+                if callback:
+                    callback(result)
+        
+        thread = threading.Thread(target=load)
+        thread.setDaemon(True)
+        thread.start()
+        return result
+    
+
+
+class AsyncResult(object):
+    """The result of a load started by AsyncORM.execute."""
+    def __init__(self):
+        import threading
+        self.event = threading.Event()
+        self.value = None
+        self.excInfo = None
+    
+    def done(self):
+        '''Checks whether the execution has ended.'''
+        return self.event.is_set()
+    
+    def wait(self, timeout=None):
+        '''
+        Waits the end of the execution.
+        
+        @return: True if the execution has ended.
+        '''
+        self.event.wait(timeout)
+        return self.event.is_set()
+    
+    def result(self, timeout=None):
+        '''
+        Waits the end of the execution and returns the 4-tuple returned by ORM.execute 
+        or raises the exception of the execution.
+        '''
+        if not self.wait(timeout):
+            raise RuntimeError('The execution has not ended')
+        if self.excInfo:
+            raise self.excInfo[0], self.excInfo[1], self.excInfo[2]
+        return self.value
+    
 
 
 # class SQLObjectORM(ORM):
@@ -448,14 +2545,560 @@ class StormORM(ORM):
 #         super(SQLObjectORM, self).__init__()
 #         self.arg = arg
 #     
-# 
-# 
-# class SQLAlchemyORM(ORM):
-#     """TODO: implement SQLAlchemy Adaptor"""
-#     def __init__(self, arg):
-#         super(SQLAlchemyORM, self).__init__()
-#         self.arg = arg
+
+
+
+class SQLAlchemyORM(ORM):
+    """
+    ORM engine for SQLAlchemy mapped classes. The headers name mapped classes, but the 
+    statements are executed with Core insert, update and delete statements on their 
+    tables: each batch is a single statement executed with the list of bound parameters 
+    of its rows (executemany), without creating objects or sessions.
+    
+    The attributes of the headers are column properties or many-to-one relationships 
+    with a single foreign key column, which receives the field value.
+    """
+    def __init__(self, uri=None, engine=None):
+        '''
+        @param uri: The database URL, used to create the engine.
+        @param engine: A SQLAlchemy engine.
+        '''
+        from sqlalchemy import create_engine, event
+        self.uri = uri
+        self.engine = engine
+        if self.uri:
+            self.engine = create_engine(self.uri)
+        if not self.engine:
+            raise Exception('None sqlalchemy engine')
+        self.connection = self.engine.connect()
+        self.isolationLevel = None
+        if self.engine.dialect.name == 'sqlite':
+            # pysqlite's own transaction handling doesn't support savepoints, so the 
+            # transactions of this connection are begun explicitly
+            dbapiConnection = self.connection.connection.connection
+            self.isolationLevel = dbapiConnection.isolation_level
+            dbapiConnection.isolation_level = None
+            event.listen(self.connection, 'begin', _sqliteBegin)
+        self.transaction = self.connection.begin()
+        # the open nested transactions, innermost last
+        self.nested = []
+        self.counter = None
+        self.attrParser = StormAttributeParser()
+    
+    def _columns(self, csvType):
+        '''
+        Returns the table of the csvType class and the key and attribute columns of 
+        csvType, as lists of (column index, column) pairs.
+        '''
+        from sqlalchemy.orm import class_mapper
+        from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
+        from sqlalchemy.orm.interfaces import MANYTOONE
+        mapper = class_mapper(csvType.type)
+        def column(name):
+            prop = mapper.get_property(name)
+            if isinstance(prop, ColumnProperty) and len(prop.columns) is 1:
+                return prop.columns[0]
+            elif isinstance(prop, RelationshipProperty) and prop.direction is MANYTOONE and \
+                len(prop.local_columns) is 1:
+                return list(prop.local_columns)[0]
+            msg = 'Attribute %s of %s is not bound to a column' % (name, csvType.typeName)
+            raise ValueError(msg)
+        keys = [(i, column(name)) for i, name in sorted(csvType.keys.items())]
+        attributes = [(i, column(name)) for i, name in sorted(csvType.attributes.items())]
+        return mapper.local_table, keys, attributes
+    
+    def executeStatement(self, csvType, csvStatement):
+        """
+        Executes a csv statement as a batch with a single statement.
+        
+        @return: Total rows affected by the statement.
+        """
+        return self.executeBatch(csvType, [csvStatement])
+    
+    def executeBatch(self, csvType, batch):
+        """
+        Executes a batch of statements with one insert, update or delete statement and 
+        the bound parameters of each row. Update and delete statements of a batch that 
+        don't match rows raise a ValueError, so that the batch is split to find them.
+        
+        @param csvType: The CSVType
+        @param batch: A list of CSVStatement
+        
+        @return: Total rows affected by the statements.
+        """
+        from sqlalchemy import and_, bindparam
+        table, keys, attributes = self._columns(csvType)
+        action = batch[0].action
+        if action is INSERT:
+            params = [dict((column.key, statement.values[i]) for i, column in keys + attributes) 
+                      for statement in batch]
+            self.connection.execute(table.insert(), params)
+            return len(batch)
+        
+        if not keys:
+            msg = 'Statement block without keys in line %d: %s' % (csvType.lineNumber, csvType.lineContent)
+            raise ValueError(msg)
+        # the parameters are named after the column indexes, column names are reserved
+        where = and_(*[column == bindparam('k%d' % i) for i, column in keys])
+        if action is UPDATE:
+            query = table.update().where(where).values(
+                dict((column.key, bindparam('v%d' % i)) for i, column in attributes))
+        else:
+            query = table.delete().where(where)
+        params = []
+        for statement in batch:
+            values = statement.values
+            param = dict(('k%d' % i, values[i]) for i, column in keys)
+            if action is UPDATE:
+                param.update(('v%d' % i, values[i]) for i, column in attributes)
+            params.append(param)
+        # the total rowcount of an executemany only tells the statements without rows when 
+        # each one matches a row at most, otherwise the statements are executed one by one
+        primaryKey = set(column.name for column in table.primary_key)
+        if len(batch) > 1 and primaryKey and primaryKey <= set(column.name for i, column in keys) and \
+            self.engine.dialect.supports_sane_multi_rowcount:
+            n = self.connection.execute(query, params).rowcount
+            if n < len(batch):
+                statement = batch[0]
+                msg = 'Statements without rows in the batch starting in line %d: %s' % \
+                    (statement.lineNumber, statement.lineContent)
+                raise ValueError(msg)
+            return n
+        n = 0
+        for statement, param in zip(batch, params):
+            rows = self.connection.execute(query, param).rowcount
+            if not rows:
+                msg = 'Statement return None in line %d: %s' % (statement.lineNumber, statement.lineContent)
+                raise ValueError(msg)
+            n += rows
+        return n
+    
+    def resolveUpserts(self, csvType, batch):
+        """
+        Resolves a batch of upsert statements with one query for each chunk of 
+        distinct keys (see StormORM.resolveUpserts).
+        """
+        from sqlalchemy import and_, or_, select
+        table, keys = self._columns(csvType)[:2]
+        if not keys:
+            msg = 'Upsert statements without keys in line %d: %s' % (csvType.lineNumber, csvType.lineContent)
+            raise ValueError(msg)
+        columns = [column for i, column in keys]
+        pairs = [(statement, tuple(statement.values[i] for i, column in keys)) for statement in batch]
+        values = list(set(key for statement, key in pairs))
+        existing = set()
+        size = max(1, SQLITE_MAX_VARIABLES/len(columns))
+        for j in xrange(0, len(values), size):
+            chunk = values[j:j+size]
+            if len(columns) is 1:
+                pred = columns[0].in_([key[0] for key in chunk])
+            else:
+                pred = or_(*[and_(*[c == v for c, v in zip(columns, key)]) for key in chunk])
+            for row in self.connection.execute(select(columns).where(pred)):
+                existing.add(tuple(row))
+        
+        return self._splitUpserts(pairs, existing)
+    
+    def startStats(self, stats):
+        """Counts the queries executed by the connection."""
+        from sqlalchemy import event
+        def count(*args):
+            stats.queries += 1
+        self.counter = count
+        event.listen(self.connection, 'before_cursor_execute', count)
+    
+    def stopStats(self, stats):
+        from sqlalchemy import event
+        event.remove(self.connection, 'before_cursor_execute', self.counter)
+        self.counter = None
+    
+    def clone(self):
+        """Returns a new SQLAlchemyORM with its own connection of the same engine."""
+        return SQLAlchemyORM(engine=self.engine)
+    
+    def close(self):
+        """Closes the connection, rolling back the uncommitted statements."""
+        if self.isolationLevel is not None:
+            self.transaction.rollback()
+            self.connection.connection.connection.isolation_level = self.isolationLevel
+        self.connection.close()
+    
+    def dependent(self, cls1, cls2):
+        """
+        Checks whether two classes are mapped to the same table or the table of one 
+        of them has a foreign key to the other.
+        """
+        from sqlalchemy.orm import class_mapper
+        table1, table2 = class_mapper(cls1).local_table, class_mapper(cls2).local_table
+        references = lambda table, other: [fk for fk in table.foreign_keys if fk.references(other)]
+        return table1 is table2 or bool(references(table1, table2) or references(table2, table1))
     
+    def references(self, cls1, cls2):
+        """Checks whether the table of cls1 has a foreign key to the table of cls2."""
+        from sqlalchemy.orm import class_mapper
+        table1, table2 = class_mapper(cls1).local_table, class_mapper(cls2).local_table
+        return any(fk.references(table2) for fk in table1.foreign_keys)
+    
+    def commit(self):
+        """Commits the transaction of the connection and begins a new one."""
+        self.transaction.commit()
+        self.transaction = self.connection.begin()
+    
+    def rollback(self):
+        """Rolls back the transaction of the connection and begins a new one."""
+        self.transaction.rollback()
+        self.transaction = self.connection.begin()
+    
+    def savepoint(self):
+        """Begins a nested transaction (SAVEPOINT) in the connection."""
+        self.nested.append(self.connection.begin_nested())
+    
+    def releaseSavepoint(self):
+        """Releases the savepoint of the innermost nested transaction."""
+        self.nested.pop().commit()
+    
+    def rollbackToSavepoint(self):
+        """Rolls back the innermost nested transaction to its savepoint."""
+        self.nested.pop().rollback()
+    
+
+
+def _sqliteBegin(connection):
+    connection.execute('BEGIN')
+
+
+class DBAPIORM(ORM):
+    """
+    ORM engine that executes the statements directly with a DB-API connection, without 
+    classes or objects. The headers name tables and their columns (after nameResolution), 
+    which are read from the database (see DBAPITables), and each batch is executed as 
+    one parameterized statement with executemany.
+    
+    >>> orm = DBAPIORM(database='statements.db')
+    >>> orm.execute('''
+    ... category, name, parent name
+    ... +, Expenses,
+    ... +, Internet, Expenses
+    ... ''')
+    (2, 0, 0, 2)
+    
+    sqlite3 is used when a database path is given. For connections of other drivers 
+    the primary keys aren't known, so the update and delete blocks must declare their 
+    {keys}.
+    """
+    def __init__(self, connection=None, database=None, paramstyle='qmark'):
+        '''
+        @param connection: A DB-API connection.
+        @param database: The path of a sqlite3 database, used to create the connection.
+        @param paramstyle: The paramstyle of the connection driver: qmark, format, 
+        pyformat or numeric.
+        '''
+        import sqlite3
+        self.database = database
+        self.connection = connection
+        if self.database:
+            self.connection = sqlite3.connect(self.database)
+        if not self.connection:
+            raise Exception('None DB-API connection')
+        self.paramstyle = paramstyle
+        self.sqlite = isinstance(self.connection, sqlite3.Connection)
+        self.isolationLevel = None
+        if self.sqlite:
+            # transactions are begun explicitly, sqlite3's implicit ones don't support savepoints
+            self.isolationLevel = self.connection.isolation_level
+            self.connection.isolation_level = None
+        self.inTransaction = False
+        self.tables = DBAPITables(self)
+        self.attrParser = StormAttributeParser()
+    
+    def execute(self, csv, **kwargs):
+        """
+        Executes the csv statements with the tables of the connection.
+        The parameters and the return are the same of ORM.execute.
+        """
+        kwargs.setdefault('module', self.tables)
+        return super(DBAPIORM, self).execute(csv, **kwargs)
+    
+    def executeConcurrently(self, csv, **kwargs):
+        """
+        Executes the csv statements concurrently with the tables of the connection.
+        The parameters and the return are the same of ORM.executeConcurrently.
+        """
+        kwargs.setdefault('module', self.tables)
+        return super(DBAPIORM, self).executeConcurrently(csv, **kwargs)
+    
+    def executeFiles(self, files, **kwargs):
+        """
+        Executes the statements of many csv files with the tables of the connection.
+        The parameters and the return are the same of ORM.executeFiles.
+        """
+        kwargs.setdefault('module', self.tables)
+        return super(DBAPIORM, self).executeFiles(files, **kwargs)
+    
+    def _run(self, sql, params, many=False):
+        '''Executes sql with params (a list of parameters if many is True) and returns the cursor.'''
+        if self.sqlite and not self.inTransaction:
+            self.connection.execute('BEGIN')
+        self.inTransaction = True
+        if self.stats:
+            self.stats.queries += 1
+        cursor = self.connection.cursor()
+        if many:
+            cursor.executemany(sql, params)
+        else:
+            cursor.execute(sql, params)
+        return cursor
+    
+    def _placeholders(self, n, start=0):
+        if self.paramstyle == 'qmark':
+            return ['?'] * n
+        elif self.paramstyle == 'numeric':
+            return [':%d' % (start + j + 1) for j in range(n)]
+        return ['%s'] * n
+    
+    def _columns(self, csvType):
+        '''Returns the key and attribute columns of csvType as lists of (column index, name) pairs.'''
+        table = csvType.type
+        keys = [(i, getattr(table, name).name) for i, name in sorted(csvType.keys.items())]
+        attributes = [(i, getattr(table, name).name) for i, name in sorted(csvType.attributes.items())]
+        return keys, attributes
+    
+    def executeStatement(self, csvType, csvStatement):
+        """
+        Executes a csv statement as a batch with a single statement.
+        
+        @return: Total rows affected by the statement.
+        """
+        return self.executeBatch(csvType, [csvStatement])
+    
+    def executeBatch(self, csvType, batch):
+        """
+        Executes a batch of statements with one INSERT, UPDATE or DELETE statement and 
+        the parameters of each row. Update and delete statements of a batch that don't 
+        match rows raise a ValueError, so that the batch is split to find them.
+        
+        @param csvType: The CSVType
+        @param batch: A list of CSVStatement
+        
+        @return: Total rows affected by the statements.
+        """
+        table = csvType.type._name
+        keys, attributes = self._columns(csvType)
+        action = batch[0].action
+        if action is INSERT:
+            columns = keys + attributes
+            sql = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(name for i, name in columns), 
+                                                      ', '.join(self._placeholders(len(columns))))
+            self._run(sql, [tuple(statement.values[i] for i, name in columns) for statement in batch], 
+                      many=True)
+            return len(batch)
+        
+        if not keys:
+            msg = 'Statement block without keys in line %d: %s' % (csvType.lineNumber, csvType.lineContent)
+            raise ValueError(msg)
+        if action is UPDATE:
+            columns = attributes + keys
+            sets = zip(attributes, self._placeholders(len(attributes)))
+            where = zip(keys, self._placeholders(len(keys), len(attributes)))
+            sql = 'UPDATE %s SET %s WHERE %s' % (table, ', '.join('%s = %s' % (name, p) for (i, name), p in sets), 
+                                                 ' AND '.join('%s = %s' % (name, p) for (i, name), p in where))
+        else:
+            columns = keys
+            where = zip(keys, self._placeholders(len(keys)))
+            sql = 'DELETE FROM %s WHERE %s' % (table, ' AND '.join('%s = %s' % (name, p) for (i, name), p in where))
+        params = [tuple(statement.values[i] for i, name in columns) for statement in batch]
+        # the total rowcount of an executemany only tells the statements without rows when 
+        # each one matches a row at most, otherwise the statements are executed one by one
+        primaryKey = set(column.name for column in csvType.type._columns.itervalues() if column.primary)
+        if len(batch) > 1 and primaryKey and primaryKey <= set(name for i, name in keys):
+            n = self._run(sql, params, many=True).rowcount
+            if 0 <= n < len(batch):
+                statement = batch[0]
+                msg = 'Statements without rows in the batch starting in line %d: %s' % \
+                    (statement.lineNumber, statement.lineContent)
+                raise ValueError(msg)
+            return n
+        n = 0
+        for statement, param in zip(batch, params):
+            rows = self._run(sql, param).rowcount
+            # drivers that don't know the rowcount return -1
+            if rows is 0:
+                msg = 'Statement return None in line %d: %s' % (statement.lineNumber, statement.lineContent)
+                raise ValueError(msg)
+            n += max(rows, 0)
+        return n
+    
+    def resolveUpserts(self, csvType, batch):
+        """
+        Resolves a batch of upsert statements with one query for each chunk of 
+        distinct keys (see StormORM.resolveUpserts).
+        """
+        keys = self._columns(csvType)[0]
+        if not keys:
+            msg = 'Upsert statements without keys in line %d: %s' % (csvType.lineNumber, csvType.lineContent)
+            raise ValueError(msg)
+        pairs = [(statement, tuple(statement.values[i] for i, name in keys)) for statement in batch]
+        values = list(set(key for statement, key in pairs))
+        existing = set()
+        size = max(1, SQLITE_MAX_VARIABLES/len(keys))
+        names = ', '.join(name for i, name in keys)
+        for j in xrange(0, len(values), size):
+            chunk = values[j:j+size]
+            placeholders = iter(self._placeholders(len(chunk)*len(keys)))
+            pred = ' OR '.join('(%s)' % ' AND '.join('%s = %s' % (name, placeholders.next()) for i, name in keys) 
+                               for key in chunk)
+            cursor = self._run('SELECT %s FROM %s WHERE %s' % (names, csvType.type._name, pred), 
+                               [v for key in chunk for v in key])
+            for row in cursor.fetchall():
+                existing.add(tuple(row))
+        
+        return self._splitUpserts(pairs, existing)
+    
+    def sqliteExecute(self, sql):
+        """Executes sql in the sqlite3 connection and returns its rows."""
+        if not self.sqlite:
+            raise NotImplementedError('Fast load needs a sqlite3 connection')
+        return self.connection.execute(sql).fetchall()
+    
+    def clone(self):
+        """Returns a new DBAPIORM connected to the same sqlite3 database."""
+        if not self.database:
+            return super(DBAPIORM, self).clone()
+        return DBAPIORM(database=self.database)
+    
+    def close(self):
+        """
+        Rolls back the uncommitted statements and closes the connection opened for the 
+        database. A connection given by the caller is left open, with its isolation 
+        level restored.
+        """
+        self.rollback()
+        if self.database:
+            self.connection.close()
+        elif self.sqlite:
+            self.connection.isolation_level = self.isolationLevel
+    
+    def dependent(self, cls1, cls2):
+        """
+        Checks whether two tables are the same or, in sqlite3 databases, one of them 
+        has a foreign key to the other. Tables of other databases are all dependent.
+        """
+        name1, name2 = cls1._name.lower(), cls2._name.lower()
+        if name1 == name2 or not self.sqlite:
+            return True
+        return name2 in cls1._references or name1 in cls2._references
+    
+    def references(self, cls1, cls2):
+        """
+        Checks whether, in sqlite3 databases, the table cls1 has a foreign key to 
+        the table cls2.
+        """
+        return cls2._name.lower() in cls1._references
+    
+    def commit(self):
+        """Commits the transaction."""
+        if self.sqlite:
+            if self.inTransaction:
+                self.connection.execute('COMMIT')
+        else:
+            self.connection.commit()
+        self.inTransaction = False
+    
+    def rollback(self):
+        """Rolls back the transaction."""
+        if self.sqlite:
+            if self.inTransaction:
+                self.connection.execute('ROLLBACK')
+        else:
+            self.connection.rollback()
+        self.inTransaction = False
+    
+    def savepoint(self):
+        """Opens a savepoint, beginning the sqlite3 transaction if needed."""
+        if self.sqlite and not self.inTransaction:
+            self.connection.execute('BEGIN')
+            self.inTransaction = True
+        self.connection.cursor().execute('SAVEPOINT %s' % SAVEPOINT)
+    
+    def releaseSavepoint(self):
+        """Releases the savepoint."""
+        self.connection.cursor().execute('RELEASE SAVEPOINT %s' % SAVEPOINT)
+    
+    def rollbackToSavepoint(self):
+        """Rolls back to the savepoint and releases it."""
+        cursor = self.connection.cursor()
+        cursor.execute('ROLLBACK TO SAVEPOINT %s' % SAVEPOINT)
+        cursor.execute('RELEASE SAVEPOINT %s' % SAVEPOINT)
+    
+
+
+class DBAPITables(object):
+    """
+    Module-like object used by DBAPIORM to resolve the headers: its attributes are 
+    DBAPITable objects, read from the database when they are first used.
+    """
+    def __init__(self, orm):
+        # the attributes start with _ so that they don't hide tables
+        self._orm = orm
+        self._tables = {}
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = DBAPITable(self._orm, name)
+        return table
+    
+
+
+class DBAPITable(object):
+    """
+    A table read from the database by DBAPITables. Its attributes are the DBAPIColumn 
+    of each column, so that the header names are resolved like class attributes, and 
+    its own attributes start with _ so that they don't hide columns.
+    """
+    def __init__(self, orm, name):
+        '''
+        @param orm: The DBAPIORM whose connection is read.
+        @param name: The name of the table.
+        '''
+        if not re.match(r'^[A-Za-z_][\w.]*$', name):
+            raise ValueError('Invalid table name: %s' % name)
+        self._name = name
+        self._columns = {}
+        self._references = set()
+        cursor = orm.connection.cursor()
+        if orm.sqlite:
+            cursor.execute('PRAGMA table_info(%s)' % name)
+            for cid, column, typeName, notNull, default, pk in cursor.fetchall():
+                self._columns[column.lower()] = DBAPIColumn(column, bool(pk))
+            cursor.execute('PRAGMA foreign_key_list(%s)' % name)
+            self._references = set(row[2].lower() for row in cursor.fetchall())
+        else:
+            cursor.execute('SELECT * FROM %s WHERE 1 = 0' % name)
+            for description in cursor.description:
+                self._columns[description[0].lower()] = DBAPIColumn(description[0], False)
+        if not self._columns:
+            raise AttributeError('Table %s not found' % name)
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        column = self._columns.get(name.lower())
+        if column is None:
+            raise AttributeError('Table %s has no column %s' % (self._name, name))
+        return column
+    
+
+
+class DBAPIColumn(object):
+    """A column of a DBAPITable."""
+    def __init__(self, name, primary):
+        self.name = name
+        self.primary = primary
+    
+
 
 
 def importClass(className, modName=None, module=None):
@@ -469,12 +3112,135 @@ def importClass(className, modName=None, module=None):
     return getattr(module, className)
 
 
+def readCheckpoint(path):
+    '''
+    Reads the line of the last committed statement from the checkpoint file path, 
+    0 if it doesn't exist.
+    '''
+    if not os.path.exists(path):
+        return 0
+    f = open(path)
+    try:
+        return int(f.read().strip() or 0)
+    finally:
+        f.close()
+
+
+def writeCheckpoint(path, lineNumber):
+    '''
+    Writes lineNumber to the checkpoint file path. The file is replaced by a renamed 
+    temporary file, so it is never left half written.
+    '''
+    temp = path + '.tmp'
+    f = open(temp, 'w')
+    try:
+        f.write('%d\n' % lineNumber)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(temp, path)
+
+
+def clearHeaderCache():
+    '''
+    Clears the process-wide cache of resolved headers used by CSVType. It must be 
+    called when the classes named in the headers change, like after reloading 
+    their modules.
+    '''
+    _headerCache.clear()
+
+
 def isPrimaryKey(cls, attrName):
     attr = getattr(cls, attrName)
     if hasattr(attr, 'primary') and attr.primary:
         return True
-    else:
-        return False
+    # sqlalchemy mapped column
+    columns = getattr(getattr(attr, 'property', None), 'columns', None)
+    if columns and len(columns) is 1 and columns[0].primary_key:
+        return True
+    return False
+
+
+def getColumn(cls, attrName):
+    '''
+    Returns the storm column of the attribute attrName of cls. For references
+    it is the column of its local key. Returns None if the attribute is not
+    bound to a single column of the class table.
+    '''
+    from storm.expr import Column
+    from storm.references import Reference
+    attr = getattr(cls, attrName)
+    if isinstance(attr, Column):
+        return attr
+    elif isinstance(attr, Reference) and not attr._on_remote:
+        localKey = attr._relation.local_key
+        if len(localKey) is 1:
+            return localKey[0]
+    return None
+
+
+def isReference(attr):
+    '''
+    Checks whether attr is a storm reference to a single row of other class, whose 
+    local key is a single column.
+    '''
+    from storm.references import Reference
+    return isinstance(attr, Reference) and not attr._on_remote and len(attr._relation.local_key) is 1
+
+
+def referencesByColumn(cls):
+    '''
+    Returns a dict that maps the id of the local key column of each storm reference 
+    of cls (see isReference) to the reference.
+    '''
+    references = {}
+    for name in dir(cls):
+        attr = getattr(cls, name, None)
+        if isReference(attr):
+            references[id(attr._relation.local_key[0])] = attr
+    return references
+
+
+def referencedClasses(cls):
+    '''
+    Returns the set of classes referenced by the storm references of cls, that is, 
+    the classes of its foreign keys.
+    '''
+    from storm.references import Reference
+    classes = set()
+    for name in dir(cls):
+        attr = getattr(cls, name, None)
+        if isinstance(attr, Reference) and not attr._on_remote:
+            classes.add(attr._relation.remote_cls)
+    return classes
+
+
+def isBulkInsertable(cls):
+    '''
+    Checks whether the objects of cls can be inserted without being instanciated.
+    Classes declaring __init__ or storm flush hooks are instanciated, unless they 
+    set the class attribute __easycsv_bulk__ to True.
+    '''
+    bulk = getattr(cls, '__easycsv_bulk__', None)
+    if bulk is not None:
+        return bool(bulk)
+    return isBulkUpdatable(cls) and cls.__init__ is object.__init__
+
+
+def isBulkUpdatable(cls):
+    '''
+    Checks whether the rows of cls can be updated and deleted without loading 
+    their objects. Classes declaring storm flush hooks are loaded, unless they 
+    set the class attribute __easycsv_bulk__ to True.
+    '''
+    bulk = getattr(cls, '__easycsv_bulk__', None)
+    if bulk is not None:
+        return bool(bulk)
+    for hook in ['__storm_pre_flush__', '__storm_flushed__']:
+        if hasattr(cls, hook):
+            return False
+    return True
 
 
 def Eq(cls, name, value):
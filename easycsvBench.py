@@ -0,0 +1,337 @@
+#!/usr/bin/python
+# -*- encoding: utf-8 -*-
+
+"""
+Benchmarks for easycsv.
+
+Run it with:
+
+    python easycsvBench.py [options] [rows ...]
+
+and compare the results before and after changing easycsv. It measures the
+per-field cost of the attribute parsers and the load of synthetic statement
+files, generated for the schema of model.py, with insert-only, update-heavy,
+delete-heavy and mixed workloads on in-memory and on-disk SQLite databases.
+For each load it reports statements/s, the peak memory of the process that
+executed it and the number of queries.
+
+Example:
+
+    python easycsvBench.py --workload insert --database memory 1000 100000 1000000
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+from multiprocessing import Process, Queue
+from Queue import Empty
+from optparse import OptionParser
+
+from easycsv import *
+
+
+FIELDS = ['123', '-45', '1.1', '6.49', 'TRUE', 'false', "'123", '01/01/2008',
+          '2.11.2008', 'Contas', 'Despesas Operacionais', 'plain vanilla']
+
+WORKLOADS = ['insert', 'update', 'delete', 'mixed']
+
+DATABASES = ['memory', 'disk']
+
+# execute options used by each configuration
+CONFIGS = {
+    'statement': dict(commit=COMMIT_STATEMENT, converters=CLASS_CONVERTERS),
+    'batch':     dict(commit=COMMIT_TYPE, batchSize=1000, converters=CLASS_CONVERTERS),
+    'fast':      dict(batchSize=1000, converters=CLASS_CONVERTERS, fastLoad=True),
+    'bulk':      dict(commit=COMMIT_TYPE, batchSize=1000, converters=CLASS_CONVERTERS),
+}
+
+# configurations loaded with the model classes marked with __easycsv_bulk__, since
+# their __init__ would otherwise keep them out of the bulk paths (see isBulkInsertable)
+BULK_CONFIGS = ['bulk']
+
+
+def benchParser(parser, fields=FIELDS, rows=20000):
+    '''
+    Parses rows times the given fields with parser.
+
+    @return: the cost of parsing one field in microseconds.
+    '''
+    parse = parser.parse
+    def run():
+        for field in fields:
+            parse(field)
+    elapsed = min(timeit.repeat(run, number=rows, repeat=3))
+    return elapsed / (rows * len(fields)) * 1e6
+
+
+def parsers():
+    '''Parsers measured by benchParser.'''
+    yield 'AttributeParser', AttributeParser()
+    yield 'StormAttributeParser', StormAttributeParser()
+    yield 'AttributeParser(cacheSize=1000)', AttributeParser(cacheSize=1000)
+    yield 'StormAttributeParser(cacheSize=1000)', StormAttributeParser(cacheSize=1000)
+
+
+def categoryName(i):
+    return 'Category %d' % i
+
+
+def accountName(i):
+    return "'%06d" % i
+
+
+def insertStatements(rows, start=0):
+    '''
+    Generates the lines of a statements file that inserts rows rows: categories,
+    bank accounts, ledger balances and statement transactions, one for each 100 rows
+    of the previous block.
+
+    @param start: The number of the first row, used to generate new keys.
+    '''
+    categories = max(1, rows/100)
+    accounts = max(1, categories/100)
+    balances = max(1, categories)
+    transactions = rows - categories - accounts - balances
+    yield 'model.Category,Name,Parent'
+    for i in xrange(start, start + categories):
+        yield '+,%s,%s' % (categoryName(i), categoryName(i/100) if i >= 100 else '')
+    yield ''
+    yield 'model.BankAccount,account,bankid,name,branch,type'
+    for i in xrange(start, start + accounts):
+        yield '+,%s,1,Account %d,0001,checking' % (accountName(i), i)
+    yield ''
+    yield 'model.LedgerBalance,bank_account,date,amount'
+    for i in xrange(start, start + balances):
+        yield '+,%s,%02d/%02d/%04d,%d.%02d' % (accountName(start + i % accounts),
+                                             1 + i % 28, 1 + i/28 % 12, 1900 + i/336, i, i % 100)
+    yield ''
+    yield 'model.StatementTransaction,memo,date,amount,type,checknum,fitid,category'
+    for i in xrange(start, start + transactions):
+        yield '+,Transaction %d,%02d/%02d/2008,%d.%02d,DEBIT,%d,fitid%d,%s' % (i, 1 + i % 28, 1 + i % 12,
+                                                                              i % 1000, i % 100, i, i,
+                                                                              categoryName(start + i % categories))
+
+
+def updateStatements(rows):
+    '''
+    Generates the lines of a statements file that updates the transactions and the
+    categories inserted by insertStatements(rows).
+    '''
+    categories = max(1, rows/100)
+    yield 'model.Category,Name,Parent'
+    for i in xrange(1, categories):
+        yield '~,%s,%s' % (categoryName(i), categoryName(0))
+    yield ''
+    yield 'model.StatementTransaction,memo,amount,{fitid}'
+    for i in xrange(rows - 3*categories):
+        yield '~,Updated %d,%d.%02d,fitid%d' % (i, i % 500, i % 100, i)
+
+
+def deleteStatements(rows):
+    '''
+    Generates the lines of a statements file that deletes the transactions inserted
+    by insertStatements(rows).
+    '''
+    categories = max(1, rows/100)
+    yield 'model.StatementTransaction,{fitid}'
+    for i in xrange(rows - 3*categories):
+        yield '-,fitid%d' % i
+
+
+def mixedStatements(rows):
+    '''
+    Generates the lines of a statements file with blocks of 100 statements, half
+    inserts, 30% updates and 20% deletes of the rows inserted by insertStatements(rows).
+    '''
+    categories = max(1, rows/100)
+    transactions = rows - 3*categories
+    blocks = [('+', 'model.StatementTransaction,memo,date,amount,type,checknum,fitid,category', 50),
+              ('~', 'model.StatementTransaction,memo,amount,{fitid}', 30),
+              ('-', 'model.StatementTransaction,{fitid}', 20)]
+    i = 0
+    while i < transactions:
+        for action, header, size in blocks:
+            yield header
+            for j in xrange(i, min(i + size, transactions)):
+                if action == '+':
+                    yield '+,New %d,01/01/2009,1.00,CREDIT,%d,new%d,%s' % (j, j, j, categoryName(j % categories))
+                elif action == '~':
+                    yield '~,Updated %d,2.00,fitid%d' % (j, j)
+                else:
+                    yield '-,fitid%d' % j
+            yield ''
+            i += size
+
+
+def createStore(uri):
+    '''Creates a store with the tables of model.py.'''
+    import model
+    from storm.locals import Store, create_database
+    store = Store(create_database(uri))
+    model.execute(store, model.salim_database_statements)
+    return store
+
+
+def setBulk():
+    '''Marks the classes loaded by the workloads with __easycsv_bulk__.'''
+    import model
+    for cls in [model.Category, model.BankAccount, model.LedgerBalance, model.StatementTransaction]:
+        cls.__easycsv_bulk__ = True
+
+
+def peakMemory():
+    '''Peak resident memory of the process, in MB.'''
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
+
+
+def runSeed(rows, filename, queue):
+    '''
+    Inserts the rows loaded by insertStatements(rows) in the database file filename
+    and puts True in queue. It runs in its own process, so that the seeding isn't
+    measured with the workload.
+    '''
+    store = createStore('sqlite:' + filename)
+    try:
+        StormORM(store=store).execute(insertStatements(rows), **CONFIGS['batch'])
+        queue.put(True)
+    except:
+        queue.put(None)
+        raise
+    finally:
+        store.close()
+
+
+def copyDatabase(orm, filename):
+    '''Copies the rows of the database file filename to the in-memory database of orm.'''
+    orm.commit()
+    orm.sqliteExecute("ATTACH DATABASE '%s' AS seed" % filename)
+    for name, in orm.sqliteExecute("SELECT name FROM seed.sqlite_master WHERE type = 'table'"):
+        orm.sqliteExecute('INSERT INTO main.%s SELECT * FROM seed.%s' % (name, name))
+    orm.sqliteExecute('DETACH DATABASE seed')
+
+
+def runLoad(workload, rows, database, config, seed, queue):
+    '''
+    Executes one load and puts its results in queue. It runs in its own process, so
+    that the peak memory is measured for this load alone.
+
+    @param seed: The database file with the rows the workload changes, used as the
+    database itself when database is disk.
+    '''
+    filename = None
+    if config in BULK_CONFIGS:
+        # the classes aren't restored, the load runs in its own process
+        setBulk()
+    if database == 'disk' and seed:
+        from storm.locals import Store, create_database
+        store = Store(create_database('sqlite:' + seed))
+    elif database == 'disk':
+        fd, filename = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        store = createStore('sqlite:' + filename)
+    else:
+        store = createStore('sqlite:')
+    try:
+        orm = StormORM(store=store)
+        if seed and database == 'memory':
+            copyDatabase(orm, seed)
+        statements = {'insert': insertStatements, 'update': updateStatements,
+                      'delete': deleteStatements, 'mixed': mixedStatements}[workload](rows)
+        stats = ExecutionStats()
+        orm.execute(statements, stats=stats, **CONFIGS[config])
+        queue.put( (stats.statements, stats.rowsPerSecond(), peakMemory(), stats.queries) )
+    except:
+        queue.put(None)
+        raise
+    finally:
+        store.close()
+        if filename:
+            os.remove(filename)
+
+
+def runProcess(target, *args):
+    '''
+    Runs target(*args, queue) in a new process.
+
+    @return: What target puts in queue, or None if the process dies without putting
+    anything, like when it is killed for lack of memory.
+    '''
+    queue = Queue()
+    process = Process(target=target, args=args + (queue,))
+    process.start()
+    try:
+        while True:
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                if not process.is_alive():
+                    try:
+                        return queue.get(timeout=1)
+                    except Empty:
+                        return None
+    finally:
+        process.join()
+
+
+def benchLoad(workload, rows, database, config):
+    '''
+    Executes one load in a new process. The rows changed by the update, delete and
+    mixed workloads are inserted by another process first.
+
+    @return: (statements, statements/s, peak memory in MB, queries) or None if the load fails.
+    '''
+    if workload == 'insert':
+        return runProcess(runLoad, workload, rows, database, config, None)
+    fd, seed = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        if not runProcess(runSeed, rows, seed):
+            return None
+        return runProcess(runLoad, workload, rows, database, config, seed)
+    finally:
+        os.remove(seed)
+
+
+def main():
+    usage = 'usage: %prog [options] [rows ...]'
+    parser = OptionParser(usage=usage)
+    parser.add_option('-w', '--workload', action='append', choices=WORKLOADS,
+                      help='workload to run (%s), may be repeated' % ', '.join(WORKLOADS))
+    parser.add_option('-d', '--database', action='append', choices=DATABASES,
+                      help='database to use (%s), may be repeated' % ', '.join(DATABASES))
+    parser.add_option('-c', '--config', action='append', choices=sorted(CONFIGS),
+                      help='execute options (%s), may be repeated' % ', '.join(sorted(CONFIGS)))
+    parser.add_option('--no-parser', action='store_true', help="don't run the parser benchmark")
+    options, args = parser.parse_args()
+    sizes = [int(arg) for arg in args] or [1000, 100000]
+
+    if not options.no_parser:
+        print 'Parsing (us/field)'
+        for name, attrParser in parsers():
+            print '  %-40s %8.3f' % (name, benchParser(attrParser))
+        print
+
+    print 'Loading (statements/s, peak MB, queries)'
+    print '  %-8s %9s %-7s %-10s %12s %12s %8s %10s' % ('workload', 'rows', 'db', 'config', 'statements',
+                                                     'stmts/s', 'peak MB', 'queries')
+    for workload in options.workload or WORKLOADS:
+        for rows in sizes:
+            for database in options.database or DATABASES:
+                for config in options.config or ['batch']:
+                    result = benchLoad(workload, rows, database, config)
+                    if result is None:
+                        print '  %-8s %9d %-7s %-10s failed' % (workload, rows, database, config)
+                        continue
+                    print '  %-8s %9d %-7s %-10s %12d %12.1f %8.1f %10d' % ((workload, rows, database, config) +
+                                                                           result)
+                    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
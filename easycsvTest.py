@@ -1,6 +1,7 @@
 #!/usr/bin/python
 # -*- encoding: latin1 -*-
 
+import csv
 import sys
 
 from unittest import TestCase, TestSuite, makeSuite, TextTestRunner
@@ -9,6 +10,43 @@ from datetime import date
 import model
 
 from easycsv import *
+from easycsv import isBulkInsertable
+from storm.locals import Unicode, Reference
+
+try:
+    from sqlalchemy import Column, Float, ForeignKey, Integer, create_engine
+    from sqlalchemy import Unicode as SAUnicode
+    from sqlalchemy.ext.declarative import declarative_base
+    from sqlalchemy.orm import relationship
+except ImportError:
+    declarative_base = None
+
+
+class PlainCategory(object):
+    """Category without __init__, inserted in bulk"""
+    __storm_table__ = "category"
+    name            = Unicode( primary=True )
+    parent_name     = Unicode()
+    parent          = Reference( parent_name, name )
+
+if declarative_base:
+    Base = declarative_base()
+    
+    class SACategory(Base):
+        """Category mapped by sqlalchemy"""
+        __tablename__ = 'category'
+        name          = Column( SAUnicode, primary_key=True )
+        parent_name   = Column( SAUnicode, ForeignKey('category.name') )
+        parent        = relationship( 'SACategory', remote_side=[name] )
+    
+    class SAEntry(Base):
+        """Entry mapped by sqlalchemy"""
+        __tablename__ = 'entry'
+        id            = Column( Integer, primary_key=True )
+        name          = Column( SAUnicode )
+        amount        = Column( Float )
+        category_name = Column( SAUnicode, ForeignKey('category.name') )
+        category      = relationship( SACategory )
 
 
 class TestStormORM(TestCase):
@@ -127,6 +165,550 @@ model.BudgetEntry,{name},category,{date},{amount},scenario,payed
         c = self.store.find(BudgetEntry, BudgetEntry.name == u'Canto dos sonhos').count()
         self.assertEqual(c, 0)
 
+    def test_5_CommitPolicy(self):
+        '''testing commit policies and rollback of failed statements'''
+        csvContent = '''
+model.Category,Name, Parent
++,Casa,
+~,Inexistente, Casa
++,Contas, Casa
+'''
+        storm = StormORM(store=self.store)
+        for commit in [COMMIT_TYPE, COMMIT_CSV, 2]:
+            self.assertEqual(storm.execute(csvContent, commit=commit), (2, 0, 0, 2))
+            self.store.find(Category, Category.name.is_in([u'Casa', u'Contas'])).remove()
+            self.store.commit()
+        self.assertRaises(ValueError, storm.execute, csvContent, commit=0)
+
+        csvDuplicated = '''
+model.Category,Name, Parent
++,Casa,
++,Contas, Casa
++,Casa,
++,Despesas, Casa
+'''
+        # the statements executed since the last commit are rolled back by the error
+        self.assertRaises(Exception, storm.execute, csvDuplicated, commit=COMMIT_CSV)
+        self.store.rollback()
+        self.assertEqual(self.store.find(Category, Category.name.is_in([u'Casa', u'Contas'])).count(), 0)
+        self.assertRaises(Exception, storm.execute, csvDuplicated, commit=2)
+        self.store.rollback()
+        cat = self.store.get(Category, u'Contas')
+        self.assertEqual(cat.parent.name, u'Casa')
+        self.assertEqual(self.store.get(Category, u'Despesas'), None)
+
+    def test_6_BulkInsert(self):
+        '''testing bulk insert of batches of insert statements'''
+        csvContent = '''
+PlainCategory,Name, Parent
++,Casa,
++,Contas, Casa
++,Despesas, Casa
+~,Despesas, Contas
++,Lazer, Casa
+'''
+        storm = StormORM(store=self.store)
+        self.assert_(isBulkInsertable(PlainCategory))
+        self.failIf(isBulkInsertable(Category))
+        r = storm.execute(csvContent, module=sys.modules[__name__], batchSize=100)
+        self.assertEqual(r, (4, 1, 0, 5))
+        self.assertEqual(self.store.get(Category, u'Contas').parent.name, u'Casa')
+        self.assertEqual(self.store.get(Category, u'Despesas').parent.name, u'Contas')
+        
+        # the batch with a duplicated row is executed again statement by statement, 
+        # and rolled back as a whole when the error is raised
+        csvDuplicated = '''
+PlainCategory,Name, Parent
++,Investimentos,
++,Casa,
+'''
+        self.assertRaises(Exception, storm.execute, csvDuplicated, 
+                          module=sys.modules[__name__], batchSize=100)
+        self.assertEqual(self.store.get(Category, u'Investimentos'), None)
+
+    def test_7_BatchedLookups(self):
+        '''testing update and delete batches with keys looked up in bulk'''
+        csvInsertContent = '''
+Category,Name
++,Contas
+
+BudgetEntry,name,category,date,amount,scenario,payed
++,Real Mastercard,Contas,2.11.2008,6.49,plain vanilla,true
++,Canto dos sonhos,Contas,4.11.2008,200.0,plain vanilla,true
++,Canto dos sonhos,Contas,5.11.2008,200.0,plain vanilla,true
++,Canto dos sonhos,Contas,6.11.2008,100.0,plain vanilla,true
+'''
+        csvContent = '''
+Category,Name,Parent
+~,Contas,Receitas
+~,Filhos,Receitas
+
+BudgetEntry,{name},category,{date},amount,scenario,payed
+~,Real Mastercard,Contas,2.11.2008,120.90,plain vanilla,false
+~,Canto dos sonhos,Contas,4.11.2008,150.0,plain vanilla,false
+
+BudgetEntry,{name},category,date,{amount},scenario,payed
+-,Canto dos sonhos,Contas,4.11.2008,200.0,plain vanilla,true
+-,Canto dos sonhos,Contas,4.11.2008,100.0,plain vanilla,true
+'''
+        storm = StormORM(store=self.store)
+        storm.execute(csvInsertContent, module=model)
+        r = storm.execute(csvContent, module=model, batchSize=100)
+        self.assertEqual(r, (0, 4, 2, 6))
+        cat = self.store.get(Category, u'Filhos')
+        self.assertEqual(cat.parent.name, u'Receitas')
+        entry = self.store.find(BudgetEntry, BudgetEntry.name == u'Real Mastercard').one()
+        self.assertEqual(entry.amount, 120.90)
+        c = self.store.find(BudgetEntry, BudgetEntry.name == u'Canto dos sonhos').count()
+        self.assertEqual(c, 1)
+
+    def test_8_ExecuteConcurrently(self):
+        '''testing concurrent execution of independent blocks'''
+        import os, tempfile
+        from storm.locals import Store
+        from storm.locals import create_database as storm_create_database
+        csvContent = '''
+model.Category,Name
++,Contas
+
+model.BankAccount,account,bankid,name
++,1234,1,Conta corrente
++,5678,1,Conta poupanca
+
+model.BudgetEntry,name,category,date,amount,scenario,payed
++,Real Mastercard,Contas,2.11.2008,6.49,plain vanilla,true
+
+model.Category,Name,Parent
+~,Contas,Receitas
+
+model.BankAccount,{account},name
+~,5678,Poupanca
+'''
+        storm = StormORM(store=self.store)
+        self.assert_(storm.dependent(BudgetEntry, Category))
+        self.assert_(storm.dependent(Category, PlainCategory))
+        self.failIf(storm.dependent(BudgetEntry, BankAccount))
+        
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            store = Store(storm_create_database('sqlite:' + filename))
+            execute(store, model.salim_database_statements)
+            storm = StormORM(store=store)
+            r = storm.executeConcurrently(csvContent, threads=3, converters=CLASS_CONVERTERS)
+            self.assertEqual(r, (4, 2, 0, 6))
+            store.rollback()
+            self.assertEqual(store.get(Category, u'Contas').parent_name, u'Receitas')
+            self.assertEqual(store.get(BankAccount, u'5678').name, u'Poupanca')
+            self.assertRaises(ValueError, storm.executeConcurrently, csvContent, threads=0)
+            
+            # two writers of the same database file wait for each other
+            import threading
+            store.rollback()
+            results = []
+            def write(k):
+                # the clones are connected by the thread that uses them
+                orm = storm.clone()
+                rows = ['model.Category,Name'] + ['*,Writer %d %d' % (k, i) for i in range(100)]
+                try:
+                    results.append(orm.execute(rows, commit=COMMIT_STATEMENT))
+                finally:
+                    orm.close()
+            writers = [threading.Thread(target=write, args=(k,)) for k in range(2)]
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+            self.assertEqual(results, [(100, 0, 0, 100)] * 2)
+            self.assertEqual(store.find(Category, Category.name.like(u'Writer %')).count(), 200)
+            store.close()
+        finally:
+            os.remove(filename)
+        self.assertRaises(NotImplementedError, StormORM(store=self.store).clone)
+
+    def test_9_ExecutionStats(self):
+        '''testing execution statistics'''
+        storm = StormORM(store=self.store)
+        stats = ExecutionStats()
+        r = storm.execute(self.csvUpdateContent, stats=stats, commit=COMMIT_CSV)
+        self.assertEqual(r, (4, 1, 0, 5))
+        self.assertEqual(stats.statements, 5)
+        self.assertEqual(stats.rows, {'model.Category': [4, 1, 0, 5]})
+        self.assert_(stats.queries >= 6)
+        self.assert_(stats.times['parse'] > 0)
+        self.assert_(stats.times['lookup'] > 0)
+        self.assert_(stats.elapsed >= stats.times['execute'])
+        self.assert_(stats.rowsPerSecond() > 0)
+        self.assert_('5 statements' in str(stats))
+        self.assertEqual(storm.stats, None)
+
+    def test_10_Export(self):
+        '''testing export of objects as statements'''
+        csvContent = '''
+Category,Name
++,Contas
+
+BudgetEntry,name,category,date,amount,scenario,payed
++,Real Mastercard,Contas,2.11.2008,6.49,plain vanilla,true
++,'123,Contas,4.11.2008,200,"a, b",false
++,'true,Contas,5.11.2008,-1.5,'09/10/2008,false
++,Nulls,\\N,\\N,\\N,'\\N,\\N
+'''
+        storm = StormORM(store=self.store)
+        storm.execute(csvContent, module=model)
+        self.assertEqual(self.store.find(BudgetEntry, BudgetEntry.name == u'Nulls').values(BudgetEntry.amount, 
+            BudgetEntry.scenario, BudgetEntry.payed).next(), (None, u'\\N', None))
+        expected = sorted(self.store.find(BudgetEntry).values(BudgetEntry.id, BudgetEntry.name, 
+            BudgetEntry.category_name, BudgetEntry.date, BudgetEntry.amount, BudgetEntry.scenario, 
+            BudgetEntry.payed))
+        
+        rows = list(storm.export(BudgetEntry, chunkSize=2))
+        self.assertEqual(rows[0], ['model.BudgetEntry', 'Id', 'Amount', 'Category Name', 'Date', 
+                                   'Name', 'Payed', 'Scenario'])
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[2][1:], ['2', '200.0', 'Contas', '04/11/2008', "'123", 'false', 'a, b'])
+        self.assertEqual(rows[4][1:], ['4', NULL, NULL, NULL, 'Nulls', NULL, "'" + NULL])
+        
+        # the export is executed back, NULL columns included, with both kinds of converters
+        from StringIO import StringIO
+        out = StringIO()
+        csv.writer(out).writerows(rows)
+        for converters in [None, CLASS_CONVERTERS]:
+            self.store.find(BudgetEntry).remove()
+            self.assertEqual(storm.execute(out.getvalue().splitlines(), converters=converters), (4, 0, 0, 4))
+            self.assertEqual(sorted(self.store.find(BudgetEntry).values(BudgetEntry.id, BudgetEntry.name, 
+                BudgetEntry.category_name, BudgetEntry.date, BudgetEntry.amount, BudgetEntry.scenario, 
+                BudgetEntry.payed)), expected)
+        
+        rows = list(storm.export(Category, self.store.find(Category, Category.name == u'Contas')))
+        self.assertEqual(rows, [['model.Category', 'Name', 'Parent Name'], ['+', 'Contas', NULL]])
+
+    def test_11_Sync(self):
+        '''testing sync of statement blocks with the database'''
+        csvContent = '''
+Category,Name
++,Contas
+
+BudgetEntry,name,category,date,amount,scenario,payed
++,a,Contas,2.11.2008,1,x,true
++,b,Contas,2.11.2008,2,x,true
++,c,Contas,2.11.2008,3,x,true
+'''
+        storm = StormORM(store=self.store)
+        storm.execute(csvContent, module=model)
+        syncContent = '''
+BudgetEntry,{name},category,date,amount,scenario,payed
++,a,Contas,2.11.2008,1,x,true
+~,b,Contas,2.11.2008,20,x,true
+~,d,Contas,3.11.2008,4,x,false
+'''
+        self.assertEqual(storm.execute(syncContent, module=model, sync=True), (1, 1, 0, 2))
+        self.assertEqual(storm.execute(syncContent, module=model, sync=True), (0, 0, 0, 0))
+        self.assertEqual(storm.execute(syncContent, module=model, sync=True, deleteMissing=True, 
+                                       commit=COMMIT_TYPE, batchSize=10), (0, 0, 1, 1))
+        self.assertEqual(sorted(self.store.find(BudgetEntry).values(BudgetEntry.name, BudgetEntry.amount)),
+                         [(u'a', 1), (u'b', 20), (u'd', 4)])
+        self.assertRaises(ValueError, storm.execute, 'BudgetEntry,name\n+,e', module=model, sync=True)
+
+    def test_12_Upsert(self):
+        '''testing upsert statements'''
+        csvContent = '''
+Category,Name
++,Contas
+
+BudgetEntry,name,category,date,amount,scenario,payed
++,a,Contas,2.11.2008,1,x,true
+
+BudgetEntry,{name},category,date,amount,scenario,payed
+*,a,Contas,2.11.2008,10,x,true
+*,b,Contas,2.11.2008,2,x,true
+*,b,Contas,2.11.2008,20,x,true
+'''
+        storm = StormORM(store=self.store)
+        self.assertEqual(storm.execute(csvContent, module=model), (3, 2, 0, 5))
+        upsertContent = csvContent.split('\n\n')[2].replace('\n*,b', '\n*,c')
+        self.assertEqual(storm.execute(upsertContent, module=model, commit=COMMIT_TYPE, batchSize=10), 
+                         (1, 2, 0, 3))
+        self.assertEqual(sorted(self.store.find(BudgetEntry).values(BudgetEntry.name, BudgetEntry.amount)),
+                         [(u'a', 10), (u'b', 20), (u'c', 20)])
+
+    def test_13_SetOperations(self):
+        '''testing update and delete statements executed as set operations'''
+        csvContent = '''
+Category,Name
++,Contas
+
+BudgetEntry,name,category,date,amount,scenario,payed
++,a,Contas,2.11.2008,1,x,true
++,b,Contas,2.11.2008,2,x,true
++,c,Contas,2.11.2008,3,y,true
+
+BudgetEntry,{scenario},payed
+~,x,false
+~,z,false
+
+BudgetEntry,{scenario}
+-,y
+'''
+        storm = StormORM(store=self.store)
+        self.assertEqual(storm.execute(csvContent, module=model, commit=COMMIT_TYPE, batchSize=10), 
+                         (4, 2, 1, 7))
+        self.assertEqual(list(self.store.find(BudgetEntry).cached()), [])
+        self.assertEqual(sorted(self.store.find(BudgetEntry).values(BudgetEntry.name, BudgetEntry.payed)),
+                         [(u'a', False), (u'b', False)])
+        
+        # set deletes of objects in the cache don't reload them for each statement
+        rows = ['BudgetEntry,name,category,date,amount,scenario,payed']
+        rows += ['+,d%d,Contas,2.11.2008,1,s%d,true' % (i, i) for i in range(50)]
+        storm.execute(rows, module=model, commit=COMMIT_TYPE, batchSize=10)
+        cached = list(self.store.find(BudgetEntry, BudgetEntry.name.like(u'd%')))
+        self.assertEqual(len(cached), 50)
+        rows = ['BudgetEntry,{scenario}'] + ['-,s%d' % i for i in range(50)]
+        stats = ExecutionStats()
+        self.assertEqual(storm.execute(rows, module=model, commit=COMMIT_TYPE, batchSize=10, stats=stats), 
+                         (0, 0, 50, 50))
+        self.assertTrue(stats.queries < 100, stats.queries)
+        self.assertEqual(self.store.find(BudgetEntry, BudgetEntry.name.like(u'd%')).count(), 0)
+        
+        # only the objects of the changed table are invalidated
+        from storm.info import get_obj_info
+        category, entry = self.store.get(Category, u'Contas'), self.store.find(BudgetEntry).any()
+        storm._invalidateTable(BudgetEntry)
+        self.assertEqual((get_obj_info(category).get('invalidated'), get_obj_info(entry).get('invalidated')), 
+                         (None, True))
+
+    def test_14_Checkpoint(self):
+        '''testing checkpointed and resumed loads'''
+        import os, tempfile
+        fd, checkpoint = tempfile.mkstemp(suffix='.checkpoint')
+        os.close(fd)
+        os.remove(checkpoint)
+        csvContent = '''Category,Name
++,Ckpt A
++,Ckpt B
++,Ckpt A
++,Ckpt C
+'''
+        storm = StormORM(store=self.store)
+        try:
+            self.assertRaises(Exception, storm.execute, csvContent, module=model, checkpoint=checkpoint)
+            self.assertEqual(open(checkpoint).read(), '3\n')
+            csvContent = csvContent.replace('+,Ckpt A\n+,Ckpt C', '+,Ckpt D\n+,Ckpt C')
+            self.assertEqual(storm.execute(csvContent, module=model, checkpoint=checkpoint), (2, 0, 0, 2))
+            self.failIf(os.path.exists(checkpoint))
+            names = self.store.find(Category, Category.name.like(u'Ckpt %')).values(Category.name)
+            self.assertEqual(sorted(names), [u'Ckpt A', u'Ckpt B', u'Ckpt C', u'Ckpt D'])
+            self.assertRaises(ValueError, storm.execute, csvContent, module=model, checkpoint=checkpoint, 
+                              sync=True, deleteMissing=True)
+        finally:
+            if os.path.exists(checkpoint):
+                os.remove(checkpoint)
+
+    def test_15_AsyncORM(self):
+        '''testing loads executed in background threads'''
+        import os, tempfile
+        from storm.locals import Store
+        from storm.locals import create_database as storm_create_database
+        rows = ['model.Category,Name,Parent', '+,Async,']
+        rows += ['+,Async %d,Async' % i for i in range(250)]
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            store = Store(storm_create_database('sqlite:' + filename))
+            execute(store, model.salim_database_statements)
+            store.commit()
+            loads = AsyncORM(StormORM(store=store), queueSize=10)
+            ended = []
+            result = loads.execute(rows, callback=ended.append, commit=COMMIT_TYPE, batchSize=50)
+            self.assertEqual(result.result(timeout=30), (251, 0, 0, 251))
+            self.assertEqual(ended, [result])
+            self.assertEqual(store.find(Category, Category.parent_name == u'Async').count(), 250)
+            
+            result = loads.execute(rows + ['+,Async'], commit=COMMIT_TYPE)
+            self.assert_(result.wait(30))
+            self.assertRaises(Exception, result.result)
+            store.close()
+        finally:
+            os.remove(filename)
+
+    def test_16_ErrorPolicy(self):
+        '''testing error policies and bisection of failed batches'''
+        from StringIO import StringIO
+        csvContent = '''model.Category,Name
++,Err A
++,Err B
++,Err A
++,Err C
++,Err D
++,Err B
++,Err E
+
+model.Category,Name,Parent
+~,Err Z,Err A
+'''
+        storm = StormORM(store=self.store)
+        deadLetter = StringIO()
+        errors = ErrorLog(deadLetter)
+        self.assertEqual(storm.execute(csvContent, commit=COMMIT_TYPE, batchSize=10, errors=errors), 
+                         (5, 0, 0, 5))
+        self.assertEqual([statement.lineNumber for t, statement, ex in errors.rejected], [4, 7, 11])
+        self.assertEqual(self.store.find(Category, Category.name.like(u'Err %')).count(), 5)
+        pairs = list(parseCSV(deadLetter.getvalue().splitlines()))
+        self.assertEqual([s and s.csvRow for t, s in pairs], 
+                         [None, ['+', 'Err A'], ['+', 'Err B'], None, ['~', 'Err Z', 'Err A']])
+        
+        self.assertRaises(ValueError, storm.execute, csvContent.split('\n\n')[1], errors=ERRORS_FAIL)
+        self.assertRaises(ValueError, storm.execute, csvContent, errors='ignore')
+        
+        # rows whose fields can't be converted are handled by the error policy
+        rows = ['model.StatementTransaction,memo,date,amount,type,checknum,fitid',
+                '+,Conv 1,01/02/2008,1.00,CREDIT,1,conv1', 
+                '+,Conv 2,31/02/2008,1.00,CREDIT,2,conv2',
+                '+,Conv 3,01/03/2008,1.00,CREDIT,3,conv3']
+        errors = ErrorLog()
+        self.assertEqual(storm.execute(rows, batchSize=10, converters=CLASS_CONVERTERS, errors=errors), 
+                         (2, 0, 0, 2))
+        self.assertEqual([statement.lineNumber for t, statement, ex in errors.rejected], [3])
+        self.assertRaises(ValueError, storm.execute, [row.replace('conv', 'fail') for row in rows], 
+                          batchSize=10, converters=CLASS_CONVERTERS, errors=ERRORS_FAIL)
+        self.assertEqual(self.store.find(StatementTransaction, StatementTransaction.fitid.like(u'fail%')).count(), 0)
+
+        # as well as the keys converted before the batch is executed
+        for options, csvContent in [({}, 'model.Category,Name\n*,Key A\n*,123\n*,Key B\n'),
+                                    ({'checkReferences': True}, 'model.Category,Name,Parent\n+,Key C,Key A\n+,Key D,456\n'),
+                                    ({'sync': True}, 'model.Category,Name\n+,Key E\n+,789\n')]:
+            errors = ErrorLog()
+            r = storm.execute(csvContent, batchSize=10, errors=errors, **options)
+            self.assertEqual((r[0], [statement.lineNumber for t, statement, ex in errors.rejected]),
+                             (csvContent.count('\n') - 2, [3]))
+            self.assertTrue(isinstance(errors.rejected[0][2], TypeError))
+        self.assertEqual(self.store.find(Category, Category.name.like(u'Key %')).count(), 4)
+
+        # the halves of a bisected batch are rolled back with it when the error is raised
+        csvContent = 'model.Category,Name\n+,Bis A\n+,Bis B\n+,Bis A\n+,Bis C\n'
+        self.assertRaises(Exception, storm.execute, csvContent, commit=100, batchSize=4, errors=ERRORS_FAIL)
+        self.assertEqual(self.store.find(Category, Category.name.like(u'Bis %')).count(), 0)
+
+    def test_17_FastLoad(self):
+        '''testing the SQLite fast-load mode'''
+        import os, tempfile
+        from storm.locals import Store
+        from storm.locals import create_database as storm_create_database
+        rows = ['model.Category,Name', '+,Fast', '', 
+                'model.StatementTransaction,memo,date,amount,type,checknum,fitid,category']
+        rows += ['+,T %d,01/01/2009,1.00,CREDIT,%d,fast%d,Fast' % (i, i, i) for i in range(20)]
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            store = Store(storm_create_database('sqlite:' + filename))
+            execute(store, model.salim_database_statements)
+            store.commit()
+            storm = StormORM(store=store)
+            pragmas = lambda: [storm.sqliteExecute('PRAGMA %s' % p)[0][0] for p in ['journal_mode', 'synchronous']]
+            indexes = lambda: sorted(storm.sqliteExecute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+            before = pragmas(), indexes()
+            
+            fastLoad = SQLiteFastLoad(dropIndexes=['statement_transaction'])
+            r = storm.execute(rows, batchSize=10, converters=CLASS_CONVERTERS, fastLoad=fastLoad)
+            self.assertEqual(r, (21, 0, 0, 21))
+            self.assertEqual((pragmas(), indexes()), before)
+            
+            rows = [row.replace('fast', 'again') for row in rows[3:]] + ['+,T 0,01/01/2009,1.00,CREDIT,0,again0,Fast']
+            self.assertRaises(Exception, storm.execute, rows, batchSize=10, converters=CLASS_CONVERTERS, 
+                              fastLoad=SQLiteFastLoad(dropIndexes=True))
+            self.assertEqual((pragmas(), indexes()), before)
+            self.assertEqual(store.find(StatementTransaction).count(), 20)
+            
+            # a load that fails before its end is rolled back as a whole
+            rows = rows[:1] + [row.replace('again', 'partial') for row in rows[1:]]
+            self.assertRaises(Exception, storm.execute, rows, batchSize=10, converters=CLASS_CONVERTERS, 
+                              errors=ERRORS_FAIL, fastLoad=True)
+            self.assertEqual(store.find(StatementTransaction).count(), 20)
+            self.assertEqual((pragmas(), indexes()), before)
+            
+            # the pragmas changed by a failed start are restored
+            self.assertRaises(TypeError, storm.execute, rows, fastLoad=SQLiteFastLoad(cacheSize='large'))
+            self.assertEqual((pragmas(), indexes()), before)
+            store.close()
+        finally:
+            os.remove(filename)
+
+    def test_18_CheckReferences(self):
+        '''testing the validation of references with cached parent keys'''
+        csvContent = '''model.Category,Name
++,Ref A
+
+model.Category,Name,Parent
++,Ref B,Ref A
++,Ref C,Ref X
++,Ref D,Ref B
+~,Ref A,Ref Y
+
+model.StatementTransaction,memo,date,amount,type,checknum,fitid,category
++,T 1,01/01/2009,1.00,CREDIT,1,ref1,Ref B
++,T 2,01/01/2009,1.00,CREDIT,2,ref2,Ref Z
+'''
+        storm = StormORM(store=self.store)
+        errors = ErrorLog()
+        r = storm.execute(csvContent, batchSize=10, converters=CLASS_CONVERTERS, errors=errors, 
+                          checkReferences=True)
+        self.assertEqual(r, (4, 0, 0, 4))
+        self.assertEqual([statement.lineNumber for t, statement, ex in errors.rejected], [6, 8, 12])
+        self.assertTrue('Missing Category' in str(errors.rejected[0][2]))
+        self.assertEqual(self.store.find(Category, Category.name.like(u'Ref %')).count(), 3)
+        self.assertEqual(self.store.get(Category, u'Ref A').parent_name, None)
+        self.assertEqual(self.store.get(Category, u'Ref D').parent_name, u'Ref B')
+        self.assertEqual(storm.parentKeys, None)
+        
+        # the foreign key columns, named by the headers of export, are checked as well
+        errors = ErrorLog()
+        r = storm.execute('model.Category,Name,Parent Name\n+,Ref E,Ref A\n+,Ref F,Ref W\n', batchSize=10, 
+                          converters=CLASS_CONVERTERS, errors=errors, checkReferences=True)
+        self.assertEqual((r, [statement.lineNumber for t, statement, ex in errors.rejected]), ((1, 0, 0, 1), [3]))
+        
+        # the parent keys cached by an ORM aren't seen by the ORMs of other databases
+        from storm.locals import Store
+        from storm.locals import create_database as storm_create_database
+        other = StormORM(store=Store(storm_create_database('sqlite:')))
+        read_file(other.store, 'salim.sql')
+        errors = ErrorLog()
+        r = other.execute(csvContent.split('\n\n')[2], batchSize=10, converters=CLASS_CONVERTERS, 
+                          errors=errors, checkReferences=True)
+        self.assertEqual((r, len(errors)), ((0, 0, 0, 0), 2))
+        other.store.close()
+        
+        self.assertRaises(ValueError, storm.execute, csvContent.split('\n\n')[2], 
+                          batchSize=10, converters=CLASS_CONVERTERS, errors=ERRORS_FAIL, checkReferences=True)
+
+    def test_19_ExecuteFiles(self):
+        '''testing the execution of many files in dependency order'''
+        from StringIO import StringIO
+        transactions = StringIO('''model.StatementTransaction,memo,date,amount,type,checknum,fitid,category
++,T 1,01/01/2009,1.00,CREDIT,1,ord1,Ord B
++,T 2,01/01/2009,1.00,CREDIT,2,ord2,Ord A
+''')
+        categories = StringIO('''model.Category,Name
++,Ord A
+
+model.StatementTransaction,memo,date,amount,type,checknum,fitid,category
++,T 3,01/01/2009,1.00,CREDIT,3,ord3,Ord A
+
+model.Category,Name,Parent
++,Ord B,Ord A
+''')
+        storm = StormORM(store=self.store)
+        types = [CSVType(['model.Category', 'Name']), CSVType(['model.StatementTransaction', 'memo']), 
+                 CSVType(['model.Category', 'Name', 'Parent'])]
+        self.assertEqual([t.type for t in storm.dependencyOrder(types[1:] + types[:1])], 
+                         [Category, Category, StatementTransaction])
+        
+        r = storm.executeFiles([transactions, categories], batchSize=10, converters=CLASS_CONVERTERS, 
+                               errors=ERRORS_FAIL, checkReferences=True)
+        self.assertEqual(r, (5, 0, 0, 5))
+        self.assertEqual(self.store.find(StatementTransaction, StatementTransaction.fitid.like(u'ord%')).count(), 3)
+        self.assertEqual(self.store.get(Category, u'Ord B').parent_name, u'Ord A')
+        self.assertRaises(ValueError, storm.executeFiles, [transactions], checkpoint='executeFiles.checkpoint')
+
 
 class TestCSV(TestCase):
     csvContent = '''
@@ -153,6 +735,282 @@ model.Category,Name, Parent
         self.assertEqual(len(csv.types[1].keys), 1)
         self.assertEqual(len(csv.types[1].attributes), 1)
     
+    def test_headerCache(self):
+        '''testing the cache of resolved headers'''
+        clearHeaderCache()
+        fields = ['model.Category', 'Name', 'Parent']
+        first, second = CSVType(fields), CSVType(fields)
+        self.assertEqual((second.type, second.keys, second.attributes, second.primaryKey), 
+                         (first.type, first.keys, first.attributes, first.primaryKey))
+        self.assert_(second.keys is not first.keys)
+        
+        resolved = []
+        def resolution(name):
+            resolved.append(name)
+            return simple(name)
+        CSVType(fields, nameResolution=resolution)
+        CSVType(fields, nameResolution=resolution)
+        self.assertEqual(len(resolved), 2)
+        clearHeaderCache()
+        CSVType(fields, nameResolution=resolution)
+        self.assertEqual(len(resolved), 4)
+    
+    def test_parseCSV(self):
+        '''testing parseCSV'''
+        pairs = list(parseCSV(self.csvContent))
+        self.assertEqual(len(pairs), 5)
+        self.assertEqual([s is None for t, s in pairs], [True, False, True, False, False])
+        self.assertEqual(pairs[3][1].lineNumber, 6)
+        self.assertEqual(len(pairs[2][0].statements), 0)
+        csv = CSV(self.csvContent)
+        self.assertEqual(len(list(csv.iterStatements())), 5)
+    
+    def test_parseCSVParallel(self):
+        '''testing parseCSVParallel'''
+        rows = ['model.BudgetEntry,name,category,date,amount,scenario,payed']
+        rows += ['+,Entry %d,Contas,2.11.2008,%d.5,plain vanilla,true' % (i, i) for i in range(50)]
+        rows += ['', 'model.Category,Name', '+,Casa']
+        for converters in [None, CLASS_CONVERTERS, 2]:
+            expected = [(t.lineNumber, s and (s.lineNumber, s.attributes)) 
+                        for t, s in parseCSV(rows, StormAttributeParser(), converters=converters)]
+            pairs = [(t.lineNumber, s and (s.lineNumber, s.attributes)) 
+                     for t, s in parseCSVParallel(rows, StormAttributeParser(), converters=converters, 
+                                                  processes=2, chunkSize=7)]
+            self.assertEqual(pairs, expected)
+        csv = CSV(rows, StormAttributeParser(), processes=2)
+        self.assertEqual(len(csv.types[0].statements), 50)
+        
+        # many small blocks are yielded while the content is read
+        read = []
+        def content():
+            for i in range(200):
+                read.append(i)
+                yield 'model.Category,Name'
+                yield '+,Small %d' % i
+        statements = parseCSVParallel(content(), StormAttributeParser(), processes=2)
+        statements.next()
+        self.assert_(len(read) < 10, len(read))
+        self.assertEqual(len(list(statements)), 399)
+    
+    def test_CSVStatement(self):
+        '''testing CSVStatement'''
+        import pickle
+        statement = CSVStatement(['+', 'Casa', '12'], StormAttributeParser())
+        statement.lineNumber = 3
+        self.assertEqual(statement.values, ('+', u'Casa', 12))
+        self.assertEqual(statement.lineContent, '+,Casa,12')
+        # joined when read, not kept
+        self.assertEqual(statement._lineContent, None)
+        statement.lineContent = '+, Casa, 12'
+        self.assertEqual(statement.lineContent, '+, Casa, 12')
+        
+        self.assertEqual(statement.attributes, {1: u'Casa', 2: 12})
+        statement.attributes = {2: 13, 4: u'Contas'}
+        self.assertEqual(statement.values, ('+', None, 13, None, u'Contas'))
+        self.assertEqual(statement.attributes, {1: None, 2: 13, 3: None, 4: u'Contas'})
+        
+        copy = pickle.loads(pickle.dumps(statement, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((copy.action, copy.csvRow, copy.values, copy.lineNumber, copy.lineContent, copy.error), 
+                         ('+', ['+', 'Casa', '12'], statement.values, 3, '+, Casa, 12', None))
+        self.assertRaises(AttributeError, setattr, statement, 'other', 1)
+    
+    def test_CSVFile(self):
+        '''testing CSVFile'''
+        import os, tempfile
+        fd, filename = tempfile.mkstemp(suffix='.csv')
+        os.write(fd, '\n'.join(self.csvContent))
+        os.close(fd)
+        try:
+            for useMmap in [False, True]:
+                expected = [(t.lineNumber, s and (s.lineNumber, s.attributes)) for t, s in parseCSV(self.csvContent)]
+                pairs = [(t.lineNumber, s and (s.lineNumber, s.attributes)) 
+                         for t, s in parseCSV(CSVFile(filename, useMmap=useMmap))]
+                self.assertEqual(pairs, expected)
+                
+                offsets = list(CSVFile(filename, useMmap=useMmap).blockOffsets())
+                self.assertEqual([lineNumber for offset, lineNumber in offsets], [1, 4])
+                offset, lineNumber = offsets[1]
+                content = CSVFile(filename, offset, lineNumber, useMmap=useMmap)
+                pairs = [(t.lineNumber, s and (s.lineNumber, s.attributes)) for t, s in parseCSV(content)]
+                self.assertEqual(pairs, expected[2:])
+                # the file can be read again from the same offset
+                self.assertEqual((content.offset, content.lineNumber), (offset, lineNumber))
+                self.assertEqual([(t.lineNumber, s and (s.lineNumber, s.attributes)) for t, s in parseCSV(content)], 
+                                 pairs)
+        finally:
+            os.remove(filename)
+    
+    def test_converters(self):
+        '''testing column converters'''
+        csvContent = '''
+model.BudgetEntry,name,category,date,amount,scenario,payed
++,123,Contas,2.11.2008,6,plain vanilla,TRUE
++,Canto dos sonhos,'Contas,4.11.2008,200.0,,false
+'''
+        csv = CSV(csvContent, attrParser=StormAttributeParser(), converters=CLASS_CONVERTERS)
+        self.assertEqual(len(csv.types[0].converters), 6)
+        values = csv.types[0].statements[0].attributes
+        self.assertEqual(values, {1: u'123', 2: u'Contas', 3: date(2008, 11, 2), 4: 6.0, 
+                                  5: u'plain vanilla', 6: True})
+        self.assertEqual(type(values[4]), float)
+        values = csv.types[0].statements[1].attributes
+        self.assertEqual(values[2], u'Contas')
+        self.assertEqual(values[5], u'')
+        self.assertEqual(values[6], False)
+        
+        csv = CSV(csvContent, attrParser=StormAttributeParser(), converters=1)
+        self.assertEqual(sorted(csv.types[0].converters), [1, 3, 4, 6])
+        values = csv.types[0].statements[1].attributes
+        self.assertEqual(values[1], u'Canto dos sonhos')
+        self.assertEqual(values[3], date(2008, 11, 4))
+        self.assertEqual(values[4], 200.0)
+        self.assertEqual(values[6], False)
+    
+
+
+class TestSQLAlchemyORM(TestCase):
+    """Tests of SQLAlchemyORM, run when sqlalchemy is installed"""
+    
+    csvContent = '''
+SACategory,Name,Parent
++,Casa,
++,Contas,Casa
+
+SAEntry,name,amount,category
++,Luz,10.5,Contas
++,Agua,20,Contas
++,Gas,30,Casa
+
+SAEntry,{name},amount
+~,Luz,11
+~,Telefone,1
+
+SAEntry,{name}
+-,Gas
+
+SAEntry,{name},amount,category
+*,Agua,21,Contas
+*,Internet,50,Contas
+'''
+    
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        
+    def test_Execute(self):
+        '''testing SQLAlchemyORM'''
+        module = sys.modules[__name__]
+        for batchSize in [1, 10]:
+            Base.metadata.drop_all(self.engine)
+            Base.metadata.create_all(self.engine)
+            orm = SQLAlchemyORM(engine=self.engine)
+            errors = ErrorLog()
+            stats = ExecutionStats()
+            r = orm.execute(self.csvContent, module=module, commit=COMMIT_TYPE, batchSize=batchSize, 
+                            errors=errors, stats=stats)
+            self.assertEqual(r, (6, 2, 1, 9))
+            self.assertEqual([statement.lineNumber for t, statement, ex in errors.rejected], [13])
+            self.assert_(stats.queries > 0)
+            rows = orm.connection.execute('SELECT name, amount, category_name FROM entry ORDER BY name')
+            self.assertEqual([tuple(row) for row in rows], [(u'Agua', 21.0, u'Contas'), 
+                (u'Internet', 50.0, u'Contas'), (u'Luz', 11.0, u'Contas')])
+            # a statement without rows isn't hidden by one that changes many rows
+            errors = ErrorLog()
+            r = orm.execute('SAEntry,{category},amount\n~,Contas,5\n~,Missing,7', module=module, 
+                            batchSize=batchSize, errors=errors)
+            self.assertEqual((r, [statement.lineNumber for t, statement, ex in errors.rejected]), 
+                             ((0, 3, 0, 3), [3]))
+            orm.close()
+        self.assert_(orm.dependent(SAEntry, SACategory))
+        self.assert_(orm.dependent(SACategory, SACategory))
+    
+
+
+class TestDBAPIORM(TestCase):
+    """Tests of DBAPIORM with sqlite3"""
+    
+    csvContent = '''
+category,Name,Parent Name
++,Casa,
++,Contas,Casa
+
+entry,name,amount,category
++,Luz,10.5,Contas
++,Agua,20,Contas
++,Gas,30,Casa
+
+entry,{name},amount
+~,Luz,11
+~,Telefone,1
+
+entry,{name}
+-,Gas
+
+entry,{name},amount,category
+*,Agua,21,Contas
+*,Internet,50,Contas
+
+category,Name,Parent Name
+~,Contas,
+'''
+    
+    def test_Execute(self):
+        '''testing DBAPIORM'''
+        import sqlite3
+        for batchSize in [1, 10]:
+            connection = sqlite3.connect(':memory:')
+            connection.executescript('''
+                CREATE TABLE category (name TEXT PRIMARY KEY, parent_name TEXT REFERENCES category (name));
+                CREATE TABLE entry (id INTEGER PRIMARY KEY, name TEXT, amount REAL, 
+                                    category TEXT REFERENCES category (name));
+            ''')
+            orm = DBAPIORM(connection)
+            errors = ErrorLog()
+            stats = ExecutionStats()
+            r = orm.execute(self.csvContent, commit=COMMIT_TYPE, batchSize=batchSize, errors=errors, stats=stats)
+            self.assertEqual(r, (6, 3, 1, 10))
+            self.assertEqual([statement.lineNumber for t, statement, ex in errors.rejected], [13])
+            self.assert_(stats.queries > 0)
+            rows = connection.execute('SELECT name, amount, category FROM entry ORDER BY name').fetchall()
+            self.assertEqual(rows, [(u'Agua', 21.0, u'Contas'), (u'Internet', 50.0, u'Contas'), 
+                                    (u'Luz', 11.0, u'Contas')])
+            self.assertEqual(connection.execute('SELECT parent_name FROM category WHERE name = ?', 
+                                                (u'Contas',)).fetchall(), [(u'',)])
+            # a statement without rows isn't hidden by one that changes many rows
+            errors = ErrorLog()
+            r = orm.execute('entry,{category},amount\n~,Contas,5\n~,Missing,7', batchSize=batchSize, 
+                            errors=errors)
+            self.assertEqual((r, [statement.lineNumber for t, statement, ex in errors.rejected]), 
+                             ((0, 3, 0, 3), [3]))
+        self.assert_(orm.dependent(orm.tables.entry, orm.tables.category))
+        self.failIf(orm.dependent(orm.tables.entry, orm.tables.entry) is False)
+        self.assertRaises(AttributeError, orm.execute, 'missing,name\n+,x')
+        # the header cache doesn't keep the tables, and so the connection, of the ORM
+        import easycsv
+        self.failIf([signature for signature in easycsv._headerCache if signature[3] is orm.tables])
+        # a connection given by the caller is left open with its isolation level
+        orm.close()
+        self.assertEqual((connection.isolation_level, connection.execute('SELECT count(*) FROM entry').fetchall()), 
+                         ('', [(3,)]))
+    
+    def test_ExecuteConcurrently(self):
+        '''testing DBAPIORM.executeConcurrently with the tables of its database'''
+        import os, tempfile
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            orm = DBAPIORM(database=filename)
+            orm.connection.executescript('''
+                CREATE TABLE category (name TEXT PRIMARY KEY, parent_name TEXT REFERENCES category (name));
+                CREATE TABLE entry (id INTEGER PRIMARY KEY, name TEXT, amount REAL, 
+                                    category TEXT REFERENCES category (name));
+            ''')
+            r = orm.executeConcurrently(self.csvContent.split('\n\nentry,{name},amount')[0], threads=2, batchSize=10)
+            self.assertEqual(r, (5, 0, 0, 5))
+            orm.close()
+        finally:
+            os.remove(filename)
+    
 
 
 class TestAttributeParser(TestCase):
@@ -200,6 +1058,18 @@ class TestAttributeParser(TestCase):
         v = parser.parse("wilson")
         self.assertEqual(v, u'wilson')
         
+    def test_ParserCache(self):
+        '''testing AttributeParser with cache'''
+        parser = StormAttributeParser(cacheSize=4)
+        for i in range(2):
+            self.assertEqual(parser.parse('012'), 12)
+            self.assertEqual(parser.parse('- 3'), -3)
+            self.assertEqual(parser.parse('1,5'), 1.5)
+            self.assertEqual(parser.parse('true'), True)
+            self.assertEqual(parser.parse('2.11.2008'), date(2008, 11, 2))
+            self.assertEqual(parser.parse('truex'), u'truex')
+        self.assert_(len(parser.cache) + len(parser.oldCache) <= 4)
+        
         
         
 if __name__ == '__main__':
@@ -207,5 +1077,8 @@ if __name__ == '__main__':
     suite.addTest(makeSuite(TestAttributeParser))
     suite.addTest(makeSuite(TestCSV))
     suite.addTest(makeSuite(TestStormORM))
+    if declarative_base:
+        suite.addTest(makeSuite(TestSQLAlchemyORM))
+    suite.addTest(makeSuite(TestDBAPIORM))
     runner = TextTestRunner(verbosity=2)
     runner.run(suite)